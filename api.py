@@ -0,0 +1,366 @@
+"""
+JSON API версии 1 поверх User, Task, File и Comment.
+
+Доступ по той же сессии, что и HTML страницы (после /login). Права те же:
+админ видит все, работник - общие задания и свои личные, без сумм оплаты.
+
+  GET /api/v1/tasks                    список заданий (type, assigned_to, is_paid)
+  GET /api/v1/tasks/<id>               одно задание
+  GET /api/v1/tasks/batch?ids=1,2,3    несколько заданий за один запрос
+  GET /api/v1/tasks/<id>/files         файлы задания
+  GET /api/v1/tasks/<id>/comments      комментарии задания
+  GET /api/v1/files/<id>               один файл
+  GET /api/v1/users                    работники (только админ)
+  GET /api/v1/users/<id>               пользователь (админ или сам пользователь)
+
+  POST /api/v1/tasks/bulk              создать задания из JSON или CSV (только админ)
+  POST /api/v1/tasks/fan-out           личное задание каждому работнику (только админ)
+  POST /api/v1/payments/settle         отметить оплату заданий за период (только админ)
+
+Параметры:
+  fields=id,title                  только перечисленные поля основного ресурса
+  fields[files]=id,original_filename, fields[comments]=...  поля вложенных списков
+  include=files,comments           вложить файлы и комментарии в задания
+  cursor=..., limit=...            постраничная выдача; курсор следующей
+                                   страницы приходит в ответе (next_cursor)
+
+POST запросы принимают только тела application/json и text/csv: такие
+запросы браузер не отправит с чужого сайта без CORS, поэтому CSRF токен
+не нужен.
+"""
+
+from flask import Blueprint, current_app, jsonify, request, url_for
+from flask_login import current_user
+from sqlalchemy import or_
+from sqlalchemy.orm import selectinload
+from werkzeug.exceptions import HTTPException
+
+from models import db, User, Task, File, Comment
+from dashboard import paginate_tasks
+from bulk import TaskImportError, parse_rows, import_tasks, validate_fan_out, fan_out_personal_task
+from payments import SettlementError, parse_date, settle_payments
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+class ApiError(Exception):
+    """Ошибка запроса к API с HTTP статусом"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def isoformat(value):
+    return value.isoformat() if value else None
+
+
+# Поле -> функция получения значения. Считаются только запрошенные поля
+TASK_FIELDS = {
+    'id': lambda t: t.id,
+    'title': lambda t: t.title,
+    'description': lambda t: t.description,
+    'task_type': lambda t: t.task_type,
+    'status': lambda t: t.status,
+    'assigned_to': lambda t: t.assigned_to,
+    'created_by': lambda t: t.created_by,
+    'created_at': lambda t: isoformat(t.created_at),
+    'updated_at': lambda t: isoformat(t.updated_at),
+    'file_count': lambda t: t.file_count,
+    'comment_count': lambda t: t.comment_count,
+    'payment_amount': lambda t: t.payment_amount,
+    'is_paid': lambda t: t.is_paid,
+}
+ADMIN_TASK_FIELDS = {'payment_amount', 'is_paid'}
+
+FILE_FIELDS = {
+    'id': lambda f: f.id,
+    'task_id': lambda f: f.task_id,
+    'original_filename': lambda f: f.original_filename,
+    'file_size': lambda f: f.file_size,
+    'mime_type': lambda f: f.mime_type,
+    'checksum': lambda f: f.checksum,
+    'uploaded_by': lambda f: f.uploaded_by,
+    'uploaded_at': lambda f: isoformat(f.uploaded_at),
+    'download_url': lambda f: url_for('download_file', file_id=f.id),
+    'thumbnail_url': lambda f: url_for('file_preview', file_id=f.id, variant='thumb') if f.thumbnail_path else None,
+}
+
+COMMENT_FIELDS = {
+    'id': lambda c: c.id,
+    'task_id': lambda c: c.task_id,
+    'user_id': lambda c: c.user_id,
+    'content': lambda c: c.content,
+    'created_at': lambda c: isoformat(c.created_at),
+}
+
+USER_FIELDS = {
+    'id': lambda u: u.id,
+    'username': lambda u: u.username,
+    'email': lambda u: u.email,
+    'full_name': lambda u: u.full_name,
+    'is_admin': lambda u: u.is_admin,
+    'created_at': lambda u: isoformat(u.created_at),
+}
+
+INCLUDES = {
+    'files': Task.files,
+    'comments': Task.comments,
+}
+
+
+@api.before_request
+def require_login():
+    if not current_user.is_authenticated:
+        return jsonify(error='Требуется вход в систему'), 401
+
+
+@api.errorhandler(ApiError)
+def handle_api_error(e):
+    return jsonify(error=str(e)), e.status
+
+
+@api.errorhandler(TaskImportError)
+def handle_import_error(e):
+    rows = [{'row': number, 'errors': errors} for number, errors in e.rows]
+    return jsonify(error=str(e), rows=rows), 400
+
+
+@api.errorhandler(SettlementError)
+def handle_settlement_error(e):
+    return jsonify(error=str(e)), 400
+
+
+@api.errorhandler(HTTPException)
+def handle_http_error(e):
+    return jsonify(error=e.description), e.code
+
+
+def split_param(name):
+    value = request.args.get(name, '')
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def select_fields(available, param='fields', hidden=()):
+    """Запрошенные поля из ?fields= (по умолчанию все доступные)"""
+    allowed = [name for name in available if name not in hidden]
+    requested = split_param(param)
+    if not requested:
+        return allowed
+    unknown = [name for name in requested if name not in allowed]
+    if unknown:
+        raise ApiError(f"Неизвестные поля {param}: {', '.join(unknown)}")
+    return requested
+
+
+def serialize(obj, available, fields):
+    return {name: available[name](obj) for name in fields}
+
+
+def requested_includes():
+    includes = split_param('include')
+    unknown = [name for name in includes if name not in INCLUDES]
+    if unknown:
+        raise ApiError(f"Неизвестные include: {', '.join(unknown)}")
+    return includes
+
+
+def get_limit():
+    limit = request.args.get('limit', type=int)
+    return min(max(limit or current_app.config['TASKS_PER_PAGE'], 1), current_app.config['MAX_TASKS_PER_PAGE'])
+
+
+def visible_tasks():
+    """Задания, доступные текущему пользователю"""
+    query = Task.query
+    if not current_user.is_admin:
+        query = query.filter(or_(Task.task_type == 'general', Task.assigned_to == current_user.id))
+    return query
+
+
+def get_visible_task(task_id):
+    task = visible_tasks().filter(Task.id == task_id).first()
+    if task is None:
+        raise ApiError('Задание не найдено', 404)
+    return task
+
+
+class TaskSerializer:
+    """Поля заданий и вложенных списков по параметрам запроса"""
+
+    def __init__(self):
+        hidden = () if current_user.is_admin else ADMIN_TASK_FIELDS
+        self.fields = select_fields(TASK_FIELDS, hidden=hidden)
+        self.includes = requested_includes()
+        self.file_fields = select_fields(FILE_FIELDS, 'fields[files]')
+        self.comment_fields = select_fields(COMMENT_FIELDS, 'fields[comments]')
+
+    def options(self):
+        """Загрузка вложенных списков одним запросом на список"""
+        return [selectinload(INCLUDES[name]) for name in self.includes]
+
+    def __call__(self, task):
+        data = serialize(task, TASK_FIELDS, self.fields)
+        if 'files' in self.includes:
+            data['files'] = [serialize(f, FILE_FIELDS, self.file_fields) for f in task.files]
+        if 'comments' in self.includes:
+            data['comments'] = [serialize(c, COMMENT_FIELDS, self.comment_fields) for c in task.comments]
+        return data
+
+
+@api.route('/tasks')
+def list_tasks():
+    serializer = TaskSerializer()
+    query = visible_tasks()
+
+    task_type = request.args.get('type')
+    if task_type:
+        query = query.filter(Task.task_type == task_type)
+    if current_user.is_admin:
+        assigned_to = request.args.get('assigned_to', type=int)
+        if assigned_to is not None:
+            query = query.filter(Task.assigned_to == assigned_to)
+        if 'is_paid' in request.args:
+            query = query.filter(Task.is_paid == (request.args['is_paid'] in ('1', 'true')))
+
+    page = paginate_tasks(query.options(*serializer.options()),
+                          after=request.args.get('cursor'), limit=get_limit(), details=False)
+    return jsonify(data=[serializer(task) for task in page.items], next_cursor=page.next_cursor)
+
+
+def require_admin():
+    if not current_user.is_admin:
+        raise ApiError('Доступно только администратору', 403)
+
+
+@api.route('/tasks/bulk', methods=['POST'])
+def bulk_create_tasks():
+    """Задания из JSON ([...] или {"tasks": [...]}) или CSV; при любой ошибке не создается ничего"""
+    require_admin()
+    if request.mimetype == 'application/json':
+        rows = parse_rows(request.get_data(), 'json')
+    elif request.mimetype == 'text/csv':
+        rows = parse_rows(request.get_data(), 'csv')
+    else:
+        raise ApiError('Ожидается Content-Type: application/json или text/csv', 415)
+    return jsonify(created=import_tasks(rows, current_user.id)), 201
+
+
+@api.route('/tasks/fan-out', methods=['POST'])
+def fan_out_tasks():
+    """{"title", "description", "payment_amount", "employee_ids"?} - личное задание каждому работнику"""
+    require_admin()
+    data = request.get_json(silent=True) if request.mimetype == 'application/json' else None
+    if not isinstance(data, dict):
+        raise ApiError('Ожидается JSON объект', 415 if request.mimetype != 'application/json' else 400)
+    employee_ids = data.get('employee_ids')
+    if employee_ids is not None and not (isinstance(employee_ids, list)
+                                         and all(isinstance(i, int) for i in employee_ids)):
+        raise ApiError('employee_ids - список id работников')
+    values = validate_fan_out(data, current_user.id)
+    return jsonify(created=fan_out_personal_task(values, employee_ids)), 201
+
+
+@api.route('/payments/settle', methods=['POST'])
+def settle():
+    """
+    {"employee_id"?, "date_from"?, "date_to"?, "dry_run"?} - отмечает оплаченными
+    неоплаченные задания с суммой и возвращает сводку без списка заданий
+    """
+    require_admin()
+    data = request.get_json(silent=True) if request.mimetype == 'application/json' else None
+    if not isinstance(data, dict):
+        raise ApiError('Ожидается JSON объект', 415 if request.mimetype != 'application/json' else 400)
+    employee_id = data.get('employee_id')
+    if employee_id is not None and not isinstance(employee_id, int):
+        raise ApiError('employee_id - id работника')
+
+    summary = settle_payments(
+        employee_id=employee_id,
+        date_from=parse_date(data.get('date_from'), 'date_from'),
+        date_to=parse_date(data.get('date_to'), 'date_to'),
+        dry_run=bool(data.get('dry_run')),
+    )
+    return jsonify(dry_run=bool(data.get('dry_run')), **summary)
+
+
+@api.route('/tasks/batch')
+def batch_tasks():
+    """Задания по списку id в порядке запроса; недоступные и несуществующие - в missing"""
+    try:
+        ids = list(dict.fromkeys(int(task_id) for task_id in split_param('ids')))
+    except ValueError:
+        raise ApiError('ids - список целых чисел через запятую')
+    if not ids:
+        raise ApiError('Не указаны ids')
+    if len(ids) > current_app.config['MAX_TASKS_PER_PAGE']:
+        raise ApiError(f"Не больше {current_app.config['MAX_TASKS_PER_PAGE']} id за запрос")
+
+    serializer = TaskSerializer()
+    tasks = {task.id: task for task in visible_tasks().filter(Task.id.in_(ids)).options(*serializer.options())}
+    return jsonify(data=[serializer(tasks[task_id]) for task_id in ids if task_id in tasks],
+                   missing=[task_id for task_id in ids if task_id not in tasks])
+
+
+@api.route('/tasks/<int:task_id>')
+def get_task(task_id):
+    serializer = TaskSerializer()
+    task = (visible_tasks().filter(Task.id == task_id)
+            .options(*serializer.options()).first())
+    if task is None:
+        raise ApiError('Задание не найдено', 404)
+    return jsonify(data=serializer(task))
+
+
+@api.route('/tasks/<int:task_id>/files')
+def task_files(task_id):
+    task = get_visible_task(task_id)
+    fields = select_fields(FILE_FIELDS)
+    files = File.query.filter_by(task_id=task.id).order_by(File.uploaded_at.desc()).all()
+    return jsonify(data=[serialize(f, FILE_FIELDS, fields) for f in files])
+
+
+@api.route('/tasks/<int:task_id>/comments')
+def task_comments(task_id):
+    task = get_visible_task(task_id)
+    fields = select_fields(COMMENT_FIELDS)
+    comments = Comment.query.filter_by(task_id=task.id).order_by(Comment.created_at).all()
+    return jsonify(data=[serialize(c, COMMENT_FIELDS, fields) for c in comments])
+
+
+@api.route('/files/<int:file_id>')
+def get_file(file_id):
+    fields = select_fields(FILE_FIELDS)
+    file_record = db.session.get(File, file_id)
+    if file_record is None:
+        raise ApiError('Файл не найден', 404)
+    get_visible_task(file_record.task_id)
+    return jsonify(data=serialize(file_record, FILE_FIELDS, fields))
+
+
+@api.route('/users')
+def list_users():
+    require_admin()
+    fields = select_fields(USER_FIELDS)
+
+    # Курсор - id последнего пользователя предыдущей страницы
+    query = User.query.filter_by(is_admin=False).order_by(User.id)
+    cursor = request.args.get('cursor', type=int)
+    if cursor is not None:
+        query = query.filter(User.id > cursor)
+    limit = get_limit()
+    users = query.limit(limit + 1).all()
+
+    next_cursor = str(users[limit - 1].id) if len(users) > limit else None
+    return jsonify(data=[serialize(u, USER_FIELDS, fields) for u in users[:limit]], next_cursor=next_cursor)
+
+
+@api.route('/users/<int:user_id>')
+def get_user(user_id):
+    if not current_user.is_admin and current_user.id != user_id:
+        raise ApiError('Нет доступа к пользователю', 403)
+    fields = select_fields(USER_FIELDS)
+    user = db.session.get(User, user_id)
+    if user is None:
+        raise ApiError('Пользователь не найден', 404)
+    return jsonify(data=serialize(user, USER_FIELDS, fields))
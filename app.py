@@ -1,14 +1,28 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, session, send_file, jsonify
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import RequestEntityTooLarge
 import os
-import uuid
-from datetime import datetime
+import base64
+import unicodedata
+from datetime import datetime, timedelta
+from urllib.parse import quote
 
 from config import Config
-from models import db, User, Task, File, Comment, init_db
-from forms import LoginForm, RegistrationForm, TaskForm, CommentForm
+from models import db, User, Task, File, Comment, Upload, init_db, setup_sqlite_pragmas
+from forms import LoginForm, RegistrationForm, TaskForm, TaskImportForm, CommentForm
+from dashboard import (admin_tasks_query, personal_tasks_query, general_tasks_query, get_employees, assignee_choices,
+                       count_tasks, paginate_tasks, load_task_details, get_dashboard_stats, get_employee_totals)
+from uploads import (UploadError, unique_path, save_stream, start_upload, write_chunk,
+                     finish_upload, abort_upload, expire_uploads)
+from blobstore import store_blob, remove_file
+from thumbnails import schedule_previews
+from cache import TTLCache, invalidate_on_commit
+from hashing import HashingBusy
+from fragments import init_fragment_cache
+from api import api
+from bulk import EVERY_EMPLOYEE, TaskImportError, parse_rows, import_tasks, task_values, fan_out_personal_task
+from sqlalchemy.orm import make_transient_to_detached
 
 def get_mimetype(filename):
     """Определение mimetype по расширению файла"""
@@ -21,14 +35,60 @@ app.config.from_object(Config)
 
 # Инициализация расширений
 db.init_app(app)
+with app.app_context():
+    setup_sqlite_pragmas(db.engine, app.config['SQLITE_PRAGMA_PROFILES'][app.config['SQLITE_PRAGMA_PROFILE']])
+fragment_cache = init_fragment_cache(app)
+app.register_blueprint(api)
+
+def paginate(query, name, details=True):
+    """Страница заданий по курсорам из URL (<name>_after / <name>_before)"""
+    page = paginate_tasks(
+        query,
+        after=request.args.get(f'{name}_after'),
+        before=request.args.get(f'{name}_before'),
+        limit=request.args.get('per_page', type=int),
+        details=details
+    )
+    
+    # Остальные параметры (в том числе курсоры других списков) сохраняем
+    args = request.args.to_dict()
+    args.update(request.view_args or {})
+    args.pop(f'{name}_after', None)
+    args.pop(f'{name}_before', None)
+    if page.next_cursor:
+        page.next_url = url_for(request.endpoint, **args, **{f'{name}_after': page.next_cursor})
+    if page.prev_cursor:
+        page.prev_url = url_for(request.endpoint, **args, **{f'{name}_before': page.prev_cursor})
+    return page
 
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Снимки пользователей по id; сбрасываются после коммита изменений или удаления.
+# Сброс виден только в своем процессе: изменения из других воркеров (в том числе
+# удаление пользователя) становятся видны не позже чем через USER_CACHE_TTL секунд
+user_cache = TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+invalidate_on_commit(User, user_cache)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    values = user_cache.get(user_id)
+    if values is None:
+        # Строка, прочитанная до коммита изменения пользователя, в кэш не попадет
+        generation = user_cache.generation()
+        user = db.session.get(User, user_id)
+        if user is not None:
+            user_cache.set(user_id, {attr.key: getattr(user, attr.key) for attr in User.__mapper__.column_attrs},
+                           generation=generation)
+        return user
+    
+    # Восстанавливаем объект из снимка и привязываем к сессии без полного SELECT
+    user = User(**values)
+    make_transient_to_detached(user)
+    db.session.add(user)
+    return user
 
 # Создание папки для загрузок
 try:
@@ -56,7 +116,17 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
-        if user and user.check_password(form.password.data):
+        try:
+            valid = user is not None and user.check_password(form.password.data)
+            # Параметры хеширования изменились - пересчитываем хеш, пока пароль известен
+            if valid and user.password_needs_rehash():
+                user.set_password(form.password.data)
+                db.session.commit()
+        except HashingBusy:
+            flash('Сервер перегружен, попробуйте войти через несколько секунд', 'error')
+            return render_template('login.html', form=form), 503
+        
+        if valid:
             login_user(user, remember=form.remember_me.data)
             next_page = request.args.get('next')
             if not next_page or not next_page.startswith('/'):
@@ -83,7 +153,11 @@ def register():
             full_name=form.full_name.data,
             is_admin=form.is_admin.data
         )
-        user.set_password(form.password.data)
+        try:
+            user.set_password(form.password.data)
+        except HashingBusy:
+            flash('Сервер перегружен, попробуйте через несколько секунд', 'error')
+            return render_template('register.html', form=form), 503
         db.session.add(user)
         db.session.commit()
         flash('Пользователь успешно зарегистрирован!', 'success')
@@ -106,20 +180,20 @@ def admin_dashboard():
         flash('У вас нет доступа к админ панели', 'error')
         return redirect(url_for('index'))
     
-    users = User.query.filter_by(is_admin=False).all()
-    tasks = Task.query.all()
-    
-    # Подсчет общей суммы оплаты
-    total_payment = sum([task.payment_amount for task in tasks if task.payment_amount])
+    users = get_employees()
+    # Файлы и комментарии загружаются только для карточек, которых нет в кэше
+    tasks = paginate(admin_tasks_query(), 'tasks', details=False)
+    fragment_cache.preload('admin', tasks.items, load_task_details)
     
-    # Подсчет оплаченных заданий
-    paid_tasks = sum([1 for task in tasks if task.is_paid])
+    # Итоговые суммы и количество считаются в базе
+    stats = get_dashboard_stats()
+    employee_totals = get_employee_totals()
     
     return render_template('admin_dashboard.html', 
                          users=users, 
                          tasks=tasks, 
-                         total_payment=total_payment,
-                         paid_tasks=paid_tasks)
+                         stats=stats,
+                         employee_totals=employee_totals)
 
 # Создание задания
 @app.route('/admin/task/create', methods=['GET', 'POST'])
@@ -131,10 +205,20 @@ def create_task():
     
     form = TaskForm()
     # Заполняем список пользователей для назначения
-    form.assigned_to.choices = [(u.id, u.full_name) for u in User.query.filter_by(is_admin=False).all()]
-    form.assigned_to.choices.insert(0, (0, 'Общее задание (для всех)'))
+    form.assigned_to.choices = assignee_choices()
+    form.assigned_to.choices.insert(1, (EVERY_EMPLOYEE, 'Каждому работнику (отдельное личное задание)'))
     
     if form.validate_on_submit():
+        if form.assigned_to.data == EVERY_EMPLOYEE:
+            if form.task_type.data != 'personal':
+                # Общее задание и так видят все - размножать можно только личное
+                form.task_type.errors.append('Каждому работнику можно назначить только личное задание')
+                return render_template('create_task.html', form=form)
+            # Одно и то же личное задание каждому работнику одним запросом
+            created = fan_out_personal_task(task_values(form, current_user.id))
+            flash(f'Создано личных заданий: {created}', 'success')
+            return redirect(url_for('admin_dashboard'))
+        
         task = Task(
             title=form.title.data,
             description=form.description.data,
@@ -150,6 +234,30 @@ def create_task():
     
     return render_template('create_task.html', form=form)
 
+# Импорт заданий из CSV или JSON
+@app.route('/admin/task/import', methods=['GET', 'POST'])
+@login_required
+def import_tasks_page():
+    if not current_user.is_admin:
+        flash('У вас нет прав для создания заданий', 'error')
+        return redirect(url_for('index'))
+    
+    form = TaskImportForm()
+    row_errors = []
+    if form.validate_on_submit():
+        upload = form.file.data
+        kind = 'json' if upload.filename.lower().endswith('.json') else 'csv'
+        try:
+            created = import_tasks(parse_rows(upload.read(), kind), current_user.id)
+        except TaskImportError as e:
+            flash(f'Задания не созданы. {e}', 'error')
+            row_errors = e.rows
+        else:
+            flash(f'Создано заданий: {created}', 'success')
+            return redirect(url_for('admin_dashboard'))
+    
+    return render_template('import_tasks.html', form=form, row_errors=row_errors)
+
 # Панель работника
 @app.route('/employee')
 @login_required
@@ -159,14 +267,18 @@ def employee_dashboard():
         return redirect(url_for('admin_dashboard'))
     
     # Личные задания
-    personal_tasks = Task.query.filter_by(assigned_to=current_user.id, task_type='personal').all()
+    personal_query = personal_tasks_query(current_user.id)
+    personal_tasks = paginate(personal_query, 'personal', details=False)
     
     # Общие задания
-    general_tasks = Task.query.filter_by(task_type='general').all()
+    general_query = general_tasks_query()
+    general_tasks = paginate(general_query, 'general', details=False)
     
     return render_template('employee_dashboard.html', 
                          personal_tasks=personal_tasks, 
-                         general_tasks=general_tasks)
+                         general_tasks=general_tasks,
+                         personal_count=count_tasks(personal_query),
+                         general_count=count_tasks(general_query))
 
 # Просмотр задания
 @app.route('/task/<int:task_id>', methods=['GET', 'POST'])
@@ -238,30 +350,31 @@ def upload_file(task_id):
     
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        # Генерируем уникальное имя файла
-        file_extension = os.path.splitext(filename)[1]
-        unique_filename = f"{uuid.uuid4().hex}{file_extension}"
+        # Генерируем уникальное имя файла в папке задания
+        unique_filename, file_path = unique_path(app.config['UPLOAD_FOLDER'], task_id, filename)
         
-        # Создаем папку для задания если её нет
-        task_folder = os.path.join(app.config['UPLOAD_FOLDER'], f'task_{task_id}')
-        os.makedirs(task_folder, exist_ok=True)
+        # Размер и контрольная сумма считаются во время записи
+        file_size, checksum = save_stream(file.stream, file_path)
         
-        file_path = os.path.join(task_folder, unique_filename)
-        file.save(file_path)
+        # Одинаковое содержимое хранится один раз
+        blob = store_blob(app.config['UPLOAD_FOLDER'], file_path, checksum, file_size)
         
         # Сохраняем информацию о файле в базу данных
         mime_type = file.content_type or get_mimetype(filename)
         file_record = File(
             filename=unique_filename,
             original_filename=filename,
-            file_path=file_path,
-            file_size=os.path.getsize(file_path),
+            file_path=blob.file_path,
+            file_size=file_size,
             mime_type=mime_type,
+            checksum=checksum,
+            blob=blob,
             task_id=task_id,
             uploaded_by=current_user.id
         )
         db.session.add(file_record)
         db.session.commit()
+        schedule_previews(app, file_record)
         
         flash('Файл успешно загружен!', 'success')
     else:
@@ -269,6 +382,123 @@ def upload_file(task_id):
     
     return redirect(url_for('view_task', task_id=task_id))
 
+def parse_upload_metadata(header):
+    """Разбирает заголовок Upload-Metadata: пары 'ключ base64(значение)' через запятую"""
+    metadata = {}
+    for pair in header.split(','):
+        parts = pair.strip().split(' ', 1)
+        if not parts[0]:
+            continue
+        try:
+            value = base64.b64decode(parts[1]).decode('utf-8') if len(parts) > 1 else ''
+        except (ValueError, UnicodeDecodeError):
+            continue
+        metadata[parts[0]] = value
+    return metadata
+
+def upload_headers(upload):
+    return {
+        'Upload-Offset': str(upload.offset),
+        'Upload-Length': str(upload.length),
+        'Tus-Resumable': '1.0.0',
+        'Cache-Control': 'no-store'
+    }
+
+# Загрузка файла частями: создание загрузки
+@app.route('/task/<int:task_id>/uploads', methods=['POST'])
+@login_required
+def create_upload(task_id):
+    task = Task.query.get_or_404(task_id)
+    if not can_access_task(task):
+        return jsonify(error='У вас нет доступа к этому заданию'), 403
+    
+    length = request.headers.get('Upload-Length', type=int)
+    if length is None or length < 0:
+        return jsonify(error='Не указан размер файла (Upload-Length)'), 400
+    if length > app.config['MAX_UPLOAD_SIZE']:
+        return jsonify(error='Файл превышает максимальный размер'), 413
+    
+    metadata = parse_upload_metadata(request.headers.get('Upload-Metadata', ''))
+    filename = secure_filename(metadata.get('filename', ''))
+    if not allowed_file(filename):
+        return jsonify(error='Неподдерживаемый формат файла'), 415
+    
+    mime_type = metadata.get('filetype') or get_mimetype(filename)
+    # Заодно удаляем брошенные загрузки, чтобы их файлы не копились на диске
+    expire_uploads(timedelta(hours=app.config['UPLOAD_EXPIRE_HOURS']))
+    upload = start_upload(app.config['UPLOAD_FOLDER'], task.id, current_user.id, filename, length, mime_type)
+    
+    headers = upload_headers(upload)
+    headers['Location'] = url_for('upload_status', upload_id=upload.id)
+    return jsonify(id=upload.id, offset=0, chunk_size=app.config['UPLOAD_CHUNK_SIZE']), 201, headers
+
+def get_own_upload(upload_id):
+    upload = Upload.query.get_or_404(upload_id)
+    if upload.user_id != current_user.id and not current_user.is_admin:
+        return None
+    return upload
+
+# Загрузка файла частями: текущее смещение
+@app.route('/upload/<upload_id>', methods=['HEAD'])
+@login_required
+def upload_status(upload_id):
+    upload = get_own_upload(upload_id)
+    if upload is None:
+        return '', 403
+    return '', 200, upload_headers(upload)
+
+# Загрузка файла частями: очередной кусок
+@app.route('/upload/<upload_id>', methods=['PATCH'])
+@login_required
+def upload_chunk(upload_id):
+    upload = get_own_upload(upload_id)
+    if upload is None:
+        return jsonify(error='Нет доступа к загрузке'), 403
+    if request.mimetype != 'application/offset+octet-stream':
+        return jsonify(error='Ожидается Content-Type: application/offset+octet-stream'), 415
+    
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        return jsonify(error='Не указано смещение (Upload-Offset)'), 400
+    
+    try:
+        offset = write_chunk(upload, request.stream, offset)
+    except UploadError as e:
+        return jsonify(error=str(e)), e.status, upload_headers(upload)
+    
+    headers = upload_headers(upload)
+    if offset == upload.length:
+        # Все байты приняты - переносим файл в хранилище содержимого
+        checksum = finish_upload(upload)
+        blob = store_blob(app.config['UPLOAD_FOLDER'], upload.file_path, checksum, upload.length)
+        file_record = File(
+            filename=upload.filename,
+            original_filename=upload.original_filename,
+            file_path=blob.file_path,
+            file_size=upload.length,
+            mime_type=upload.mime_type,
+            checksum=checksum,
+            blob=blob,
+            task_id=upload.task_id,
+            uploaded_by=upload.user_id
+        )
+        db.session.add(file_record)
+        db.session.commit()
+        schedule_previews(app, file_record)
+    
+    return '', 204, headers
+
+# Загрузка файла частями: отмена
+@app.route('/upload/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_upload(upload_id):
+    upload = get_own_upload(upload_id)
+    if upload is None:
+        return jsonify(error='Нет доступа к загрузке'), 403
+    abort_upload(upload)
+    db.session.commit()
+    return '', 204
+
 # Скачивание файла
 @app.route('/file/<int:file_id>/download')
 @login_required
@@ -300,13 +530,80 @@ def download_file(file_id):
     # Получаем правильный mimetype
     mimetype = file_record.mime_type or get_mimetype(file_record.original_filename)
     
-    return send_file(
+    # Доступ проверен - передачу байтов отдаем прокси, воркер сразу свободен
+    if app.config['FILE_SERVING_MODE'] in ('x-accel', 'x-sendfile'):
+        response = proxy_file_response(file_record, mimetype)
+        if response is not None:
+            return response
+    
+    # conditional=True: ответы 304 по If-None-Match/If-Modified-Since и 206 на Range.
+    # ETag - SHA-256 содержимого, для старых файлов без него Werkzeug строит свой
+    response = send_file(
         file_record.file_path,
         as_attachment=True,
         download_name=file_record.original_filename,
         mimetype=mimetype,
+        conditional=True,
+        etag=file_record.checksum or True,
+        last_modified=file_record.uploaded_at,
         max_age=0
     )
+    # Файлы доступны только после входа - общим кэшам их хранить нельзя
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.accept_ranges = 'bytes'
+    return response
+
+# Миниатюра или превью изображения
+@app.route('/file/<int:file_id>/<any(thumb, preview):variant>')
+@login_required
+def file_preview(file_id, variant):
+    file_record = File.query.get_or_404(file_id)
+    if not can_access_task(file_record.task):
+        return '', 403
+    
+    path = file_record.thumbnail_path if variant == 'thumb' else file_record.preview_path
+    if not path or not os.path.exists(path):
+        return '', 404
+    
+    # Превью не меняется, пока существует файл, - браузер может хранить его долго
+    response = send_file(path, mimetype='image/webp', conditional=True,
+                         etag=f"{file_record.checksum or file_record.id}-{variant}",
+                         max_age=7 * 24 * 3600)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+def proxy_file_response(file_record, mimetype):
+    """Пустой ответ с X-Accel-Redirect/X-Sendfile: файл с диска отдает front-прокси"""
+    upload_folder = os.path.abspath(app.config['UPLOAD_FOLDER'])
+    file_path = os.path.abspath(file_record.file_path)
+    relative_path = os.path.relpath(file_path, upload_folder)
+    if relative_path.startswith(os.pardir):
+        # Файл вне папки загрузок прокси не видит
+        return None
+    
+    response = app.response_class(mimetype=mimetype)
+    if app.config['FILE_SERVING_MODE'] == 'x-accel':
+        prefix = app.config['X_ACCEL_PREFIX'].rstrip('/')
+        response.headers['X-Accel-Redirect'] = f"{prefix}/{quote(relative_path.replace(os.sep, '/'))}"
+    else:
+        response.headers['X-Sendfile'] = file_path
+    
+    # Эти заголовки прокси сохраняет, Range и ETag обрабатывает сам.
+    # Имя файла кодируется как в send_file: заголовки передаются в latin-1
+    filename = file_record.original_filename
+    try:
+        filename.encode('ascii')
+        response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        response.headers.set('Content-Disposition', 'attachment', filename=simple,
+                             **{'filename*': f"UTF-8''{quote(filename, safe='')}"})
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 # Обновление статуса оплаты
 @app.route('/admin/task/<int:task_id>/payment', methods=['POST'])
@@ -338,13 +635,19 @@ def view_employee_profile(user_id):
         return redirect(url_for('admin_dashboard'))
 
     # Получаем задания работника
-    personal_tasks = Task.query.filter_by(assigned_to=user_id, task_type='personal').all()
-    general_tasks = Task.query.filter_by(task_type='general').all()
+    personal_query = personal_tasks_query(user_id)
+    personal_tasks = paginate(personal_query, 'personal', details=False)
+    general_query = general_tasks_query()
+    general_tasks = paginate(general_query, 'general', details=False)
+    totals = get_employee_totals(user_id).get(user_id)
 
     return render_template('employee_profile.html',
                          employee=user,
                          personal_tasks=personal_tasks,
-                         general_tasks=general_tasks)
+                         general_tasks=general_tasks,
+                         personal_count=count_tasks(personal_query),
+                         general_count=count_tasks(general_query),
+                         totals=totals)
 
 # Редактирование данных работника
 @app.route('/admin/user/<int:user_id>/edit', methods=['GET', 'POST'])
@@ -375,13 +678,17 @@ def edit_employee(user_id):
                 flash('Пользователь с таким email уже существует', 'error')
                 return redirect(url_for('edit_employee', user_id=user_id))
 
+        if form.password.data:
+            try:
+                user.set_password(form.password.data)
+            except HashingBusy:
+                flash('Сервер перегружен, попробуйте через несколько секунд', 'error')
+                return render_template('edit_employee.html', form=form, employee=user), 503
+
         user.username = form.username.data
         user.email = form.email.data
         user.full_name = form.full_name.data
 
-        if form.password.data:
-            user.set_password(form.password.data)
-
         db.session.commit()
         flash('Данные работника обновлены!', 'success')
         return redirect(url_for('view_employee_profile', user_id=user_id))
@@ -410,9 +717,12 @@ def delete_user(user_id):
     for task in user.assigned_tasks:
         task.assigned_to = None
     for file in user.uploaded_files:
+        remove_file(file)
         db.session.delete(file)
     for comment in user.comments:
         db.session.delete(comment)
+    for upload in Upload.query.filter_by(user_id=user.id).all():
+        abort_upload(upload)
 
     db.session.delete(user)
     db.session.commit()
@@ -432,8 +742,7 @@ def edit_task(task_id):
     form = TaskForm()
 
     # Заполняем список пользователей для назначения
-    form.assigned_to.choices = [(u.id, u.full_name) for u in User.query.filter_by(is_admin=False).all()]
-    form.assigned_to.choices.insert(0, (0, 'Общее задание (для всех)'))
+    form.assigned_to.choices = assignee_choices()
 
     if form.validate_on_submit():
         task.title = form.title.data
@@ -467,8 +776,9 @@ def delete_task(task_id):
 
     # Удаляем связанные файлы
     for file in task.files:
-        if os.path.exists(file.file_path):
-            os.remove(file.file_path)
+        remove_file(file)
+    for upload in task.uploads:
+        abort_upload(upload)
 
     db.session.delete(task)
     db.session.commit()
@@ -476,13 +786,18 @@ def delete_task(task_id):
     flash('Задание удалено!', 'success')
     return redirect(url_for('admin_dashboard'))
 
+def can_access_task(task):
+    """Админ видит все задания, работник - общие и назначенные ему"""
+    return current_user.is_admin or task.task_type == 'general' or task.assigned_to == current_user.id
+
 def allowed_file(filename):
     if not filename or '.' not in filename:
         return False
     extension = filename.rsplit('.', 1)[1].lower()
     return extension in app.config['ALLOWED_EXTENSIONS']
 
+# Сервер разработки. В продакшене: gunicorn -c gunicorn.conf.py wsgi:app
 if __name__ == '__main__':
     with app.app_context():
         init_db()
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -3,80 +3,747 @@
 
 """
 Скрипт для резервного копирования базы данных и файлов
+
+Бэкапы бывают полными и инкрементальными. В каждом архиве лежит
+manifest.json - полный список файлов на момент бэкапа (путь, размер, время
+изменения, SHA-256) с указанием архива, в котором хранится содержимое.
+Инкрементальный бэкап записывает только новые и измененные файлы, остальные
+ссылаются на предыдущие архивы цепочки, поэтому восстановление собирает
+полный снимок из базового архива и нужных инкрементов.
+
+Уже сжатые файлы (изображения, видео, архивы) сохраняются без повторного
+сжатия.
+
+Файлы сжимаются параллельно в BACKUP_WORKERS процессах (см. parallel_zip.py),
+архив собирается за один проход.
+
+База данных копируется на ходу через online backup API SQLite: небольшими
+порциями страниц с паузами, чтобы приложение продолжало писать в базу.
+Снимок проходит PRAGMA integrity_check и только потом попадает в архив.
+
+Рядом с архивом пишется индекс <имя>.index.json, все индексы сведены в
+каталог backups/catalog.db: list, find и diff работают без чтения архивов.
+По каталогу же после каждого бэкапа применяются правила хранения.
 """
 
 import os
 import shutil
+import sqlite3
 import datetime
+import hashlib
+import json
+import tempfile
+import threading
+import time
+import zlib
 import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-def create_backup():
+from parallel_zip import ZipAssembler, write_members
+
+BACKUP_DIR = Path("backups")
+DB_PATH = "instance/task_manager.db"
+DB_ARCNAME = "database/task_manager.db"
+UPLOADS_DIR = "uploads"
+MANIFEST_NAME = "manifest.json"
+
+# После стольких инкрементов подряд делается полный бэкап
+MAX_CHAIN_LENGTH = int(os.environ.get("BACKUP_MAX_CHAIN", 7))
+BLOCK_SIZE = 1024 * 1024
+
+# Процессов для сжатия файлов и уровень deflate
+BACKUP_WORKERS = int(os.environ.get("BACKUP_WORKERS") or os.cpu_count() or 1)
+COMPRESS_LEVEL = int(os.environ.get("BACKUP_COMPRESS_LEVEL", 6))
+
+# Сколько бэкапов хранить: последние, по дням, неделям и месяцам;
+# общий размер архивов в МБ (0 - без ограничения)
+KEEP_LAST = int(os.environ.get("BACKUP_KEEP_LAST", 3))
+KEEP_DAILY = int(os.environ.get("BACKUP_KEEP_DAILY", 7))
+KEEP_WEEKLY = int(os.environ.get("BACKUP_KEEP_WEEKLY", 4))
+KEEP_MONTHLY = int(os.environ.get("BACKUP_KEEP_MONTHLY", 6))
+MAX_TOTAL_SIZE = int(float(os.environ.get("BACKUP_MAX_TOTAL_MB", 0)) * 1024 * 1024)
+
+# Снимок базы: страниц за шаг и пауза между шагами (секунды)
+DB_SNAPSHOT_PAGES = int(os.environ.get("BACKUP_DB_PAGES", 256))
+DB_SNAPSHOT_SLEEP = float(os.environ.get("BACKUP_DB_SLEEP", 0.05))
+# Если база меняется быстрее, чем копируется, копирование начинается заново.
+# После стольких перезапусков снимок делается одним шагом (в WAL писателям это не мешает)
+DB_SNAPSHOT_MAX_RESTARTS = 3
+
+# Форматы, которые уже сжаты: deflate только тратит время
+COMPRESSED_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic",
+    ".mp4", ".mov", ".avi", ".mkv", ".webm", ".mp3", ".m4a", ".ogg",
+    ".zip", ".rar", ".7z", ".gz", ".bz2", ".xz", ".zst",
+    ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".pdf",
+}
+# Файлы хранилища (uploads/blobs) без расширения: пробуем сжать первый блок
+SAMPLE_SIZE = 64 * 1024
+MIN_COMPRESSION_GAIN = 0.1
+
+class SnapshotError(Exception):
+    """Снимок базы данных не прошел проверку"""
+
+class _SnapshotRestarted(Exception):
+    pass
+
+def _copy_database(src, dst, pages, sleep, max_restarts):
+    """Копирует базу шагами по pages страниц с паузой sleep; возвращает число перезапусков"""
+    state = {"remaining": None, "restarts": 0}
+
+    def progress(status, remaining, total):
+        # Оставшихся страниц стало больше - источник изменился и копирование началось заново
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            state["restarts"] += 1
+            if max_restarts is not None and state["restarts"] > max_restarts:
+                raise _SnapshotRestarted()
+        state["remaining"] = remaining
+        if remaining and sleep:
+            time.sleep(sleep)
+
+    src.backup(dst, pages=pages, progress=progress)
+    return state["restarts"]
+
+def snapshot_database(db_path, snapshot_path, pages=DB_SNAPSHOT_PAGES, sleep=DB_SNAPSHOT_SLEEP):
+    """
+    Делает согласованный снимок работающей базы через sqlite3.Connection.backup
+    и проверяет его PRAGMA integrity_check. Возвращает сведения о снимке.
+    """
+    started = time.monotonic()
+    src = sqlite3.connect(db_path)
+    dst = sqlite3.connect(snapshot_path)
+    try:
+        try:
+            restarts = _copy_database(src, dst, pages, sleep, DB_SNAPSHOT_MAX_RESTARTS)
+        except _SnapshotRestarted:
+            restarts = _copy_database(src, dst, -1, 0, None) + DB_SNAPSHOT_MAX_RESTARTS + 1
+
+        # Снимок - самостоятельный файл без WAL-журнала
+        dst.execute("PRAGMA journal_mode=DELETE")
+        problems = [row[0] for row in dst.execute("PRAGMA integrity_check")]
+        if problems != ["ok"]:
+            raise SnapshotError(f"integrity_check: {'; '.join(problems[:5])}")
+
+        return {
+            "page_size": dst.execute("PRAGMA page_size").fetchone()[0],
+            "pages": dst.execute("PRAGMA page_count").fetchone()[0],
+            "restarts": restarts,
+            "seconds": round(time.monotonic() - started, 3),
+            "integrity": "ok",
+        }
+    finally:
+        src.close()
+        dst.close()
+
+def file_hash(file_path):
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def source_files(db_snapshot=None):
+    """Пары (имя в архиве, путь на диске) для снимка базы и всех загруженных файлов"""
+    files = []
+    if db_snapshot is not None:
+        files.append((DB_ARCNAME, str(db_snapshot)))
+    if os.path.exists(UPLOADS_DIR):
+        for root, dirs, names in os.walk(UPLOADS_DIR):
+            for name in names:
+                file_path = os.path.join(root, name)
+                arc_path = Path(UPLOADS_DIR, os.path.relpath(file_path, UPLOADS_DIR)).as_posix()
+                files.append((arc_path, file_path))
+    return files
+
+def target_path(arcname):
+    """Куда восстанавливать файл из архива"""
+    if arcname == DB_ARCNAME:
+        return DB_PATH
+    return arcname
+
+def is_compressed(file_path):
+    """Файл уже сжат и deflate его почти не уменьшит"""
+    if os.path.splitext(file_path)[1].lower() in COMPRESSED_EXTENSIONS:
+        return True
+    with open(file_path, "rb") as f:
+        sample = f.read(SAMPLE_SIZE)
+    if len(sample) < 1024:
+        return False
+    return len(zlib.compress(sample, 1)) > len(sample) * (1 - MIN_COMPRESSION_GAIN)
+
+def read_manifest(archive_path):
+    """manifest.json из архива или None для архивов старого формата"""
+    with zipfile.ZipFile(archive_path) as zipf:
+        if MANIFEST_NAME not in zipf.namelist():
+            return None
+        return json.loads(zipf.read(MANIFEST_NAME))
+
+def list_archives():
+    """Архивы бэкапов от новых к старым"""
+    if not BACKUP_DIR.exists():
+        return []
+    return sorted(BACKUP_DIR.glob("backup_*.zip"), reverse=True)
+
+def previous_manifest():
+    """Манифест последнего бэкапа, от которого можно сделать инкремент"""
+    archives = list_archives()
+    if not archives:
+        return None
+    manifest = load_index(archives[0])
+    if manifest["type"] == "legacy" or manifest["chain_length"] >= MAX_CHAIN_LENGTH:
+        return None
+    # Цепочка неполная (архив удален вручную) - начинаем новую
+    if archives_in_use(manifest) - {archive.stem for archive in archives}:
+        return None
+    return manifest
+
+def archives_in_use(manifest):
+    """Имена архивов, без которых нельзя восстановить этот бэкап"""
+    return {entry["archive"] for entry in manifest["files"].values()} | {manifest["name"]}
+
+# ---- Индекс бэкапов ----
+#
+# Рядом с каждым архивом лежит <имя>.index.json: манифест, размер архива,
+# сведения о снимке базы и имена загруженных файлов из таблицы files.
+# Все индексы сведены в каталог backups/catalog.db, по которому list, find
+# и diff отвечают, не открывая архивы. Каталог - производные данные: он
+# сверяется с архивами в папке и при необходимости пересобирается из индексов.
+
+def index_path(name):
+    return BACKUP_DIR / f"{name}.index.json"
+
+def uploaded_files(db_path):
+    """Загруженные файлы из снимка базы: [id, id задания, исходное имя, имя в архиве]"""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("SELECT id, task_id, original_filename, file_path FROM files").fetchall()
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
+    return [[file_id, task_id, original, member_name(file_path)]
+            for file_id, task_id, original, file_path in rows if member_name(file_path)]
+
+def write_index(manifest, archive_path, uploads):
+    """Записывает индекс бэкапа рядом с архивом"""
+    index = dict(manifest, archive_size=archive_path.stat().st_size, uploads=uploads)
+    temp_path = index_path(manifest["name"]).with_suffix(".tmp")
+    temp_path.write_text(json.dumps(index, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+    os.replace(temp_path, index_path(manifest["name"]))
+    return index
+
+def build_index(archive_path):
+    """Индекс для архива, созданного без него: манифест (или список файлов старого архива) читается один раз"""
+    name = archive_path.stem
+    manifest = read_manifest(archive_path)
+    if manifest is None:
+        with zipfile.ZipFile(archive_path) as zipf:
+            files = {
+                info.filename: {"size": info.file_size, "mtime": None, "sha256": None, "archive": name}
+                for info in zipf.infolist() if not info.is_dir()
+            }
+        manifest = {
+            "name": name, "type": "legacy", "parent": None, "chain_length": 0,
+            "created_at": datetime.datetime.fromtimestamp(archive_path.stat().st_mtime).isoformat(),
+            "database": None, "files": files,
+        }
+        return write_index(manifest, archive_path, [])
+
+    uploads = []
+    entry = manifest["files"].get(DB_ARCNAME)
+    if entry is not None:
+        reader = ArchiveReader(BACKUP_DIR)
+        try:
+            with tempfile.TemporaryDirectory() as work_dir:
+                db_copy = os.path.join(work_dir, "task_manager.db")
+                extract_verified(reader, DB_ARCNAME, entry, db_copy)
+                uploads = uploaded_files(db_copy)
+        except (RestoreError, zipfile.BadZipFile, KeyError, OSError):
+            # Архив с базой уже удален - индекс без имен файлов
+            pass
+        finally:
+            reader.close()
+    return write_index(manifest, archive_path, uploads)
+
+def load_index(archive_path):
+    """Индекс бэкапа; для архивов без индекса он создается"""
+    path = index_path(archive_path.stem)
+    if path.exists():
+        return json.loads(path.read_text(encoding="utf-8"))
+    return build_index(archive_path)
+
+CATALOG_PATH = BACKUP_DIR / "catalog.db"
+# Меняется вместе со схемой каталога: старый каталог пересобирается из индексов
+CATALOG_VERSION = 1
+
+CATALOG_SCHEMA = """
+CREATE TABLE backups (
+    name TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    parent TEXT,
+    chain_length INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    archive_size INTEGER NOT NULL,
+    file_count INTEGER NOT NULL,
+    total_size INTEGER NOT NULL,
+    written_count INTEGER NOT NULL,
+    written_size INTEGER NOT NULL,
+    db_pages INTEGER,
+    db_sha256 TEXT
+);
+CREATE TABLE members (
+    backup TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER,
+    sha256 TEXT,
+    archive TEXT NOT NULL,
+    PRIMARY KEY (backup, path)
+) WITHOUT ROWID;
+CREATE INDEX ix_members_path ON members (path);
+CREATE INDEX ix_members_sha256 ON members (sha256);
+CREATE TABLE uploads (
+    backup TEXT NOT NULL,
+    file_id INTEGER NOT NULL,
+    task_id INTEGER,
+    original_filename TEXT,
+    path TEXT NOT NULL
+);
+CREATE INDEX ix_uploads_backup_path ON uploads (backup, path);
+"""
+
+def catalog_add(conn, index):
+    name = index["name"]
+    files = index["files"]
+    written = [entry for entry in files.values() if entry["archive"] == name]
+    database = index.get("database") or {}
+    db_entry = files.get(DB_ARCNAME) or {}
+    conn.execute(
+        "INSERT INTO backups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (name, index["type"], index["parent"], index["chain_length"], index["created_at"],
+         index["archive_size"], len(files), sum(entry["size"] for entry in files.values()),
+         len(written), sum(entry["size"] for entry in written),
+         database.get("pages"), db_entry.get("sha256")),
+    )
+    conn.executemany(
+        "INSERT INTO members VALUES (?, ?, ?, ?, ?, ?)",
+        [(name, path, entry["size"], entry["mtime"], entry["sha256"], entry["archive"])
+         for path, entry in files.items()],
+    )
+    conn.executemany(
+        "INSERT INTO uploads VALUES (?, ?, ?, ?, ?)",
+        [(name, *upload) for upload in index.get("uploads", [])],
+    )
+
+def catalog_remove(conn, name):
+    for table, column in (("backups", "name"), ("members", "backup"), ("uploads", "backup")):
+        conn.execute(f"DELETE FROM {table} WHERE {column} = ?", (name,))
+
+def open_catalog():
+    """
+    Каталог бэкапов, сверенный с архивами в папке: удаленные архивы убираются,
+    новые добавляются из индексов. Возвращает соединение sqlite3.
+    """
+    BACKUP_DIR.mkdir(exist_ok=True)
+    conn = sqlite3.connect(CATALOG_PATH)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != CATALOG_VERSION:
+        with conn:
+            for table in ("backups", "members", "uploads"):
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.executescript(CATALOG_SCHEMA)
+            conn.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+
+    archives = {archive.stem: archive for archive in list_archives()}
+    known = {row[0] for row in conn.execute("SELECT name FROM backups")}
+    with conn:
+        for name in known - set(archives):
+            catalog_remove(conn, name)
+            if index_path(name).exists():
+                index_path(name).unlink()
+        for name in sorted(set(archives) - known):
+            catalog_add(conn, load_index(archives[name]))
+    return conn
+
+# ---- Хранение бэкапов ----
+#
+# Дед-отец-сын: последние BACKUP_KEEP_LAST бэкапов, последний бэкап каждого из
+# BACKUP_KEEP_DAILY дней, BACKUP_KEEP_WEEKLY недель и BACKUP_KEEP_MONTHLY
+# месяцев. Вместе с оставленным бэкапом остаются все архивы его цепочки.
+# Если оставленное больше BACKUP_MAX_TOTAL_MB, отбрасываются самые старые
+# бэкапы (последний остается всегда). Решение принимается по каталогу,
+# архивы не читаются.
+
+def retention_plan(backups, depends_on, keep_last=KEEP_LAST, keep_daily=KEEP_DAILY,
+                   keep_weekly=KEEP_WEEKLY, keep_monthly=KEEP_MONTHLY, max_total_size=MAX_TOTAL_SIZE):
+    """
+    backups - [(имя, datetime создания, размер архива)] от новых к старым,
+    depends_on - {имя: архивы, без которых его не восстановить}.
+    Возвращает {имя: причина} для бэкапов, которые нужно оставить.
+    """
+    reasons = {}
+    for name, _, _ in backups[:keep_last]:
+        reasons[name] = "последний"
+
+    rules = (
+        ("день", keep_daily, lambda created: created.date()),
+        ("неделя", keep_weekly, lambda created: created.isocalendar()[:2]),
+        ("месяц", keep_monthly, lambda created: (created.year, created.month)),
+    )
+    for reason, count, period in rules:
+        periods = set()
+        for name, created, _ in backups:
+            key = period(created)
+            if key in periods:
+                continue
+            if len(periods) >= count:
+                break
+            periods.add(key)
+            reasons.setdefault(name, reason)
+
+    sizes = {name: size for name, _, size in backups}
+    roots = [name for name, _, _ in backups if name in reasons]
+
+    def needed(roots):
+        keep = {root: reasons[root] for root in roots}
+        for root in roots:
+            for name in sorted(depends_on.get(root, set())):
+                keep.setdefault(name, f"основа для {root}")
+        return keep
+
+    keep = needed(roots)
+    while max_total_size and len(roots) > 1 and sum(sizes.get(name, 0) for name in keep) > max_total_size:
+        roots.pop()
+        keep = needed(roots)
+    return keep
+
+def apply_retention(dry_run=False):
+    """Удаляет бэкапы, которые не нужно хранить; dry_run - только показать план"""
+    conn = open_catalog()
+    try:
+        backups = [
+            (name, datetime.datetime.fromisoformat(created_at), size)
+            for name, created_at, size in conn.execute(
+                "SELECT name, created_at, archive_size FROM backups ORDER BY name DESC")
+        ]
+        depends_on = {}
+        for name, archive in conn.execute("SELECT DISTINCT backup, archive FROM members"):
+            depends_on.setdefault(name, set()).add(archive)
+
+        keep = retention_plan(backups, depends_on)
+        removed = [(name, size) for name, _, size in backups if name not in keep]
+        if dry_run:
+            for name, _, size in backups:
+                print(f"   {'✓' if name in keep else '✗'} {name}  {megabytes(size):>10}  {keep.get(name, 'удалить')}")
+        else:
+            for name, size in list(removed):
+                try:
+                    for path in (BACKUP_DIR / f"{name}.zip", index_path(name)):
+                        if path.exists():
+                            path.unlink()
+                except OSError as e:
+                    # Архив остается в каталоге, попробуем удалить в следующий раз
+                    print(f"⚠ Не удалось удалить {name}.zip: {e}")
+                    removed.remove((name, size))
+                    continue
+                with conn:
+                    catalog_remove(conn, name)
+                print(f"✓ Старый бэкап удален: {name}.zip")
+    finally:
+        conn.close()
+
+    removed_size = sum(size for _, size in removed)
+    line = (f"Хранится бэкапов: {len(backups) - len(removed)} "
+            f"({megabytes(sum(size for _, _, size in backups) - removed_size)})")
+    if removed:
+        line += (", будет удалено" if dry_run else ", удалено") + \
+            f": {len(removed)} ({megabytes(removed_size)})"
+    print(line)
+    if MAX_TOTAL_SIZE and sum(size for name, _, size in backups if name in keep) > MAX_TOTAL_SIZE:
+        print(f"⚠ Последняя цепочка бэкапов больше BACKUP_MAX_TOTAL_MB ({megabytes(MAX_TOTAL_SIZE)})")
+    return keep
+
+def create_backup(full=False, workers=BACKUP_WORKERS):
     """Создает резервную копию базы данных и файлов"""
 
     # Создаем папку для бэкапов
-    backup_dir = Path("backups")
-    backup_dir.mkdir(exist_ok=True)
+    BACKUP_DIR.mkdir(exist_ok=True)
 
     # Генерируем имя файла с timestamp
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     backup_name = f"backup_{timestamp}"
-    backup_path = backup_dir / backup_name
+    # Второй бэкап в ту же секунду не должен перезаписать первый, на который он ссылается
+    suffix = 1
+    while (BACKUP_DIR / f"{backup_name}.zip").exists():
+        backup_name = f"backup_{timestamp}_{suffix}"
+        suffix += 1
+    backup_path = BACKUP_DIR / f"{backup_name}.zip"
 
-    print(f"Создание резервной копии: {backup_name}")
+    previous = None if full else previous_manifest()
+    kind = "incremental" if previous else "full"
+    print(f"Создание резервной копии: {backup_name} ({'инкрементальная' if previous else 'полная'})")
 
+    snapshot = BACKUP_DIR / f".{backup_name}.db"
     try:
-        with zipfile.ZipFile(f"{backup_path}.zip", 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Добавляем базу данных
-            if os.path.exists("instance/task_manager.db"):
-                zipf.write("instance/task_manager.db", "database/task_manager.db")
-                print("✓ База данных добавлена")
-
-            # Добавляем файлы uploads
-            if os.path.exists("uploads"):
-                for root, dirs, files in os.walk("uploads"):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arc_path = os.path.join("uploads", os.path.relpath(file_path, "uploads"))
-                        zipf.write(file_path, arc_path)
-                print("✓ Файлы добавлены")
-
-        # Удаляем старые бэкапы (оставляем последние 10)
-        backups = sorted(backup_dir.glob("*.zip"), reverse=True)
-        if len(backups) > 10:
-            for old_backup in backups[10:]:
-                old_backup.unlink()
-                print(f"✓ Старый бэкап удален: {old_backup.name}")
-
-        print(f"✅ Резервная копия создана: {backup_path}.zip")
-        return True
+        database = None
+        uploads = []
+        if os.path.exists(DB_PATH):
+            database = snapshot_database(DB_PATH, snapshot)
+            uploads = uploaded_files(snapshot)
+            print(f"✓ Снимок базы данных: {database['pages']} страниц, integrity_check: ok")
+        else:
+            # Базу PostgreSQL/MySQL копируют ее собственными средствами (pg_dump и т.п.)
+            print(f"⚠ База SQLite {DB_PATH} не найдена: в бэкап попадут только файлы")
+
+        old_files = previous["files"] if previous else {}
+        files = {}
+        changed = []
+        for arcname, file_path in source_files(snapshot if database else None):
+            stat = os.stat(file_path)
+            old = old_files.get(arcname)
+            if old and old["size"] == stat.st_size and old["mtime"] == stat.st_mtime_ns:
+                # Файл не менялся - содержимое берется из предыдущего архива
+                files[arcname] = old
+                continue
+            if arcname == DB_ARCNAME and old and old["sha256"] == file_hash(file_path):
+                # Снимок всегда новый файл, но база могла не измениться
+                files[arcname] = old
+                continue
+            changed.append((arcname, file_path, stat))
+
+        with ZipAssembler(backup_path) as archive, tempfile.TemporaryDirectory(dir=BACKUP_DIR) as spool_dir:
+            members = [(arcname, file_path, stat.st_mtime_ns / 1e9) for arcname, file_path, stat in changed]
+            hashes = write_members(archive, members, spool_dir, workers=workers,
+                                   level=COMPRESS_LEVEL, store=is_compressed)
+            for arcname, file_path, stat in changed:
+                files[arcname] = {
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime_ns,
+                    "sha256": hashes[arcname],
+                    "archive": backup_name,
+                }
+
+            manifest = {
+                "name": backup_name,
+                "type": kind,
+                "parent": previous["name"] if previous else None,
+                "chain_length": previous["chain_length"] + 1 if previous else 0,
+                "created_at": datetime.datetime.now().isoformat(),
+                "database": database,
+                "files": files,
+            }
+            archive.writestr(MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, indent=1))
+
+        print(f"✓ Записано файлов: {len(changed)} из {len(files)}")
+        write_index(manifest, backup_path, uploads)
+        print(f"✅ Резервная копия создана: {backup_path}")
 
     except Exception as e:
         print(f"❌ Ошибка при создании бэкапа: {e}")
+        if backup_path.exists():
+            backup_path.unlink()
+        if index_path(backup_name).exists():
+            index_path(backup_name).unlink()
         return False
 
-def restore_backup(backup_file):
-    """Восстанавливает данные из резервной копии"""
+    finally:
+        if snapshot.exists():
+            snapshot.unlink()
+
+    # Бэкап уже записан: ошибка при удалении старых не должна его затронуть
+    try:
+        apply_retention()
+    except Exception as e:
+        print(f"⚠ Ошибка при удалении старых бэкапов: {e}")
+    return True
+
+class RestoreError(Exception):
+    """Файл из архива не совпал с манифестом"""
+
+class ArchiveReader:
+    """Открытые архивы цепочки: у каждого потока свои объекты ZipFile"""
+
+    def __init__(self, backup_dir):
+        self.backup_dir = Path(backup_dir)
+        self.local = threading.local()
+        self.opened = []
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        archives = getattr(self.local, "archives", None)
+        if archives is None:
+            archives = self.local.archives = {}
+        if name not in archives:
+            archives[name] = zipfile.ZipFile(self.backup_dir / f"{name}.zip")
+            with self.lock:
+                self.opened.append(archives[name])
+        return archives[name]
+
+    def close(self):
+        for zipf in self.opened:
+            zipf.close()
+
+def extract_verified(reader, arcname, entry, destination):
+    """
+    Распаковывает файл через временный файл, сверяя SHA-256 с манифестом.
+    Файл на месте заменяется только после успешной проверки.
+    """
+    os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+    temp_path = f"{destination}.restore"
+    hasher = hashlib.sha256()
+    try:
+        with reader.get(entry["archive"]).open(arcname) as src, open(temp_path, "wb") as dst:
+            for block in iter(lambda: src.read(BLOCK_SIZE), b""):
+                hasher.update(block)
+                dst.write(block)
+        if hasher.hexdigest() != entry["sha256"]:
+            raise RestoreError("SHA-256 не совпадает с манифестом")
+        os.utime(temp_path, ns=(entry["mtime"], entry["mtime"]))
+        os.replace(temp_path, destination)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return entry["size"]
+
+def remove_wal_files(db_path):
+    # Журнал WAL от прежней базы не подходит к восстановленной
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+def member_name(file_path):
+    """Имя в архиве для пути из таблицы files"""
+    path = Path(file_path)
+    if path.is_absolute():
+        parts = path.parts
+        if UPLOADS_DIR not in parts:
+            return None
+        path = Path(*parts[parts.index(UPLOADS_DIR):])
+    return Path(os.path.normpath(path)).as_posix()
+
+def file_rows(db_path, task_ids=None, user_ids=None):
+    """Строки files (id, task_id, пути) из снимка базы; фильтр по заданиям или работникам"""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(files)")}
+        preview_columns = [c for c in ("thumbnail_path", "preview_path") if c in columns]
+        select = ", ".join(["files.id", "files.task_id", "files.file_path"] + [f"files.{c}" for c in preview_columns])
+        query = f"SELECT {select} FROM files"
+        conditions, params = [], []
+        if task_ids:
+            conditions.append(f"files.task_id IN ({', '.join('?' * len(task_ids))})")
+            params += list(task_ids)
+        if user_ids:
+            marks = ", ".join("?" * len(user_ids))
+            query += " JOIN tasks ON tasks.id = files.task_id"
+            conditions.append(f"(tasks.assigned_to IN ({marks}) OR files.uploaded_by IN ({marks}))")
+            params += list(user_ids) * 2
+        if conditions:
+            query += " WHERE " + " OR ".join(conditions)
+        return [(row[0], row[1], [path for path in row[2:] if path]) for row in conn.execute(query, params)]
+    finally:
+        conn.close()
+
+def subset_members(reader, manifest, task_ids, user_ids):
+    """Имена в архиве для файлов выбранных заданий или работников по снимку базы из бэкапа"""
+    entry = manifest["files"].get(DB_ARCNAME)
+    if entry is None:
+        raise RestoreError("В бэкапе нет базы данных, выбрать файлы заданий нельзя")
+    with tempfile.TemporaryDirectory() as work_dir:
+        db_copy = os.path.join(work_dir, "task_manager.db")
+        extract_verified(reader, DB_ARCNAME, entry, db_copy)
+        rows = file_rows(db_copy, task_ids, user_ids)
+
+    members = set()
+    for _, _, paths in rows:
+        for file_path in paths:
+            name = member_name(file_path)
+            if name:
+                members.add(name)
+    return members, len(rows)
+
+def check_file_paths(db_path, root):
+    """Пути File.file_path из восстановленной базы, которых нет на диске"""
+    missing = []
+    for file_id, task_id, paths in file_rows(db_path):
+        file_path = paths[0]
+        resolved = file_path if os.path.isabs(file_path) else os.path.join(root, file_path)
+        if not os.path.isfile(resolved):
+            missing.append((file_id, task_id, file_path))
+    return missing
+
+def restore_backup(backup_file, task_ids=None, user_ids=None, target=".", workers=BACKUP_WORKERS):
+    """
+    Восстанавливает данные из резервной копии (с учетом цепочки инкрементов).
+
+    task_ids / user_ids - восстановить только файлы этих заданий (или заданий
+    и загрузок этих работников); база данных при этом не заменяется.
+    target - папка, в которую восстанавливать (по умолчанию текущая).
+    """
 
     if not os.path.exists(backup_file):
         print(f"❌ Файл бэкапа не найден: {backup_file}")
         return False
 
+    reader = ArchiveReader(Path(backup_file).parent)
     try:
-        with zipfile.ZipFile(backup_file, 'r') as zipf:
-            # Восстанавливаем базу данных
-            if "database/task_manager.db" in zipf.namelist():
-                # Создаем папку instance
-                os.makedirs("instance", exist_ok=True)
-                zipf.extract("database/task_manager.db", "instance/")
-                os.rename("instance/database/task_manager.db", "instance/task_manager.db")
-                print("✓ База данных восстановлена")
-
-            # Восстанавливаем файлы
-            for file_info in zipf.filelist:
-                if file_info.filename.startswith("uploads/"):
-                    zipf.extract(file_info.filename, ".")
-                    print(f"✓ Файл восстановлен: {file_info.filename}")
+        manifest = read_manifest(backup_file)
+        if manifest is None:
+            if task_ids or user_ids:
+                print("❌ Выборочное восстановление недоступно для архивов старого формата")
+                return False
+            return restore_legacy_backup(backup_file)
+
+        missing = sorted(archives_in_use(manifest) - {path.stem for path in reader.backup_dir.glob("*.zip")})
+        if missing:
+            print(f"❌ Не найдены архивы цепочки: {', '.join(missing)}")
+            return False
+
+        entries = manifest["files"]
+        subset = bool(task_ids or user_ids)
+        if subset:
+            members, file_count = subset_members(reader, manifest, task_ids, user_ids)
+            absent = members - set(entries)
+            entries = {name: entries[name] for name in members if name in entries}
+            print(f"✓ Выбрано файлов в базе: {file_count}, для восстановления: {len(entries)}")
+            if absent:
+                print(f"⚠ Нет в бэкапе: {len(absent)} (например, {sorted(absent)[0]})")
+
+        started = time.monotonic()
+        errors = []
+        restored_bytes = 0
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            futures = {
+                pool.submit(extract_verified, reader, arcname, entry,
+                            os.path.join(target, target_path(arcname))): arcname
+                for arcname, entry in entries.items()
+            }
+            for future in as_completed(futures):
+                try:
+                    restored_bytes += future.result()
+                except (RestoreError, zipfile.BadZipFile, KeyError, OSError) as e:
+                    errors.append(f"{futures[future]}: {e}")
+
+        elapsed = time.monotonic() - started
+        print(f"✓ Восстановлено файлов: {len(entries) - len(errors)} "
+              f"({restored_bytes / (1024 * 1024):.1f} МБ за {elapsed:.1f} с), проверены по SHA-256")
+
+        db_path = os.path.join(target, DB_PATH)
+        if DB_ARCNAME in entries and os.path.exists(db_path):
+            remove_wal_files(db_path)
+            not_found = check_file_paths(db_path, target)
+            if not_found:
+                print(f"⚠ В базе есть файлы, которых нет на диске: {len(not_found)}")
+                for file_id, task_id, file_path in not_found[:10]:
+                    print(f"   файл #{file_id} задания #{task_id}: {file_path}")
+            else:
+                print("✓ Все файлы из базы данных найдены на диске")
+
+        if errors:
+            print(f"❌ Ошибки при восстановлении: {len(errors)}")
+            for error in errors[:10]:
+                print(f"   {error}")
+            return False
 
         print("✅ Данные восстановлены из бэкапа")
         return True
@@ -85,44 +752,245 @@ def restore_backup(backup_file):
         print(f"❌ Ошибка при восстановлении: {e}")
         return False
 
-def list_backups():
-    """Показывает список доступных бэкапов"""
+    finally:
+        reader.close()
 
-    backup_dir = Path("backups")
-    if not backup_dir.exists():
-        print("Папка backups не существует")
-        return
+def restore_legacy_backup(backup_file):
+    """Восстановление из архива без manifest.json (старый формат)"""
+    with zipfile.ZipFile(backup_file, 'r') as zipf:
+        # Восстанавливаем базу данных
+        if DB_ARCNAME in zipf.namelist():
+            os.makedirs("instance", exist_ok=True)
+            with zipf.open(DB_ARCNAME) as src, open(DB_PATH, "wb") as dst:
+                shutil.copyfileobj(src, dst, BLOCK_SIZE)
+            remove_wal_files(DB_PATH)
+            print("✓ База данных восстановлена")
+
+        # Восстанавливаем файлы
+        for file_info in zipf.filelist:
+            if file_info.filename.startswith("uploads/"):
+                zipf.extract(file_info.filename, ".")
+                print(f"✓ Файл восстановлен: {file_info.filename}")
+
+    print("✅ Данные восстановлены из бэкапа")
+    return True
+
+def benchmark(size_mb=256, file_count=16, worker_counts=None):
+    """
+    Время сборки архива из синтетических файлов (сжимаемых примерно вдвое)
+    при разном числе процессов
+    """
+    cores = os.cpu_count() or 1
+    if not worker_counts:
+        worker_counts = sorted({1, 2, 4, 8, 16, cores} & set(range(1, cores + 1)))
+    file_size = size_mb * 1024 * 1024 // file_count
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        members = []
+        for number in range(file_count):
+            path = os.path.join(work_dir, f"file_{number}.dat")
+            with open(path, "wb") as f:
+                f.write(os.urandom(file_size // 2).hex().encode())
+            members.append((f"uploads/file_{number}.dat", path, time.time()))
+
+        print(f"Ядер: {cores}, данных: {size_mb} МБ в {file_count} файлах")
+        print(f"{'Процессов':>10}{'Секунд':>10}{'МБ/с':>10}{'Ускорение':>12}")
+        baseline = None
+        for workers in worker_counts:
+            archive_path = os.path.join(work_dir, "benchmark.zip")
+            started = time.perf_counter()
+            with ZipAssembler(archive_path) as archive:
+                write_members(archive, members, work_dir, workers=workers, level=COMPRESS_LEVEL)
+            elapsed = time.perf_counter() - started
+            os.remove(archive_path)
+            baseline = baseline or elapsed
+            print(f"{workers:>10}{elapsed:>10.2f}{size_mb / elapsed:>10.1f}{baseline / elapsed:>11.2f}x")
+
+BACKUP_TYPES = {"full": "полный", "incremental": "инкремент", "legacy": "старый формат"}
+# Сколько путей показывать в каждом разделе find и diff
+SHOW_LIMIT = 20
+
+def megabytes(size):
+    return f"{size / (1024 * 1024):.1f} МБ"
 
-    backups = sorted(backup_dir.glob("*.zip"), reverse=True)
-    if not backups:
+def list_backups():
+    """Показывает список доступных бэкапов по каталогу"""
+
+    conn = open_catalog()
+    try:
+        rows = conn.execute(
+            "SELECT name, type, parent, archive_size, file_count, total_size, written_count "
+            "FROM backups ORDER BY name DESC"
+        ).fetchall()
+    finally:
+        conn.close()
+    if not rows:
         print("Бэкапы не найдены")
         return
 
     print("Доступные бэкапы:")
-    for i, backup in enumerate(backups, 1):
-        size_mb = backup.stat().st_size / (1024 * 1024)
-        print(".1f")
+    for i, (name, kind, parent, archive_size, file_count, total_size, written_count) in enumerate(rows, 1):
+        line = (f"{i:>3}. {name}  {BACKUP_TYPES.get(kind, kind):<13} {megabytes(archive_size):>10}  "
+                f"файлов: {file_count} ({megabytes(total_size)}), записано: {written_count}")
+        if parent:
+            line += f", основа: {parent}"
+        print(line)
+    print(f"Всего: {len(rows)}, {megabytes(sum(row[3] for row in rows))}")
+
+def backup_name(value):
+    """Имя бэкапа из имени или пути к архиву"""
+    return Path(value).name.removesuffix(".zip").removesuffix(".index.json")
+
+def find_in_backups(pattern):
+    """
+    В каких бэкапах есть файл: по пути в архиве, исходному имени загруженного
+    файла (часть имени) или по содержимому, если pattern - существующий файл.
+    """
+    conn = open_catalog()
+    try:
+        query = (
+            "SELECT m.path, m.backup, m.size, m.sha256, m.archive, u.original_filename, u.file_id, u.task_id "
+            "FROM members m LEFT JOIN uploads u ON u.backup = m.backup AND u.path = m.path "
+        )
+        if os.path.isfile(pattern):
+            rows = conn.execute(query + "WHERE m.sha256 = ? ORDER BY m.path, m.backup DESC",
+                                (file_hash(pattern),)).fetchall()
+        else:
+            like = "%" + pattern.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            rows = conn.execute(
+                query + "WHERE m.path LIKE ? ESCAPE '\\' OR u.original_filename LIKE ? ESCAPE '\\' "
+                "ORDER BY m.path, m.backup DESC",
+                (like, like),
+            ).fetchall()
+    finally:
+        conn.close()
+
+    if not rows:
+        print(f"Файл не найден ни в одном бэкапе: {pattern}")
+        return
+
+    paths = {}
+    for row in rows:
+        paths.setdefault(row[0], []).append(row)
+    for path, versions in list(paths.items())[:SHOW_LIMIT]:
+        _, _, _, _, _, original, file_id, task_id = versions[0]
+        print(f"{path}" + (f"  ({original}, файл #{file_id} задания #{task_id})" if original else ""))
+        for _, backup, size, sha256, archive, _, _, _ in versions:
+            stored = "" if archive == backup else f", хранится в {archive}"
+            print(f"   {backup}  {megabytes(size)}  {(sha256 or '-')[:12]}{stored}")
+    if len(paths) > SHOW_LIMIT:
+        print(f"... и еще путей: {len(paths) - SHOW_LIMIT}")
+
+def diff_backups(first, second):
+    """Чем бэкап second отличается от first: добавленные, удаленные и измененные файлы"""
+    first, second = backup_name(first), backup_name(second)
+    conn = open_catalog()
+    try:
+        found = dict(conn.execute("SELECT name, db_sha256 FROM backups WHERE name IN (?, ?)", (first, second)))
+        for name in (first, second):
+            if name not in found:
+                print(f"❌ Бэкап не найден: {name}")
+                return False
+
+        member_query = (
+            "SELECT m.path, m.size, u.original_filename FROM members m "
+            "LEFT JOIN uploads u ON u.backup = m.backup AND u.path = m.path "
+            "WHERE m.backup = ? AND m.path NOT IN (SELECT path FROM members WHERE backup = ?) ORDER BY m.path"
+        )
+        sections = [
+            ("Добавлено", conn.execute(member_query, (second, first)).fetchall()),
+            ("Удалено", conn.execute(member_query, (first, second)).fetchall()),
+            ("Изменено", conn.execute(
+                "SELECT b.path, b.size, u.original_filename FROM members a "
+                "JOIN members b ON b.backup = ? AND b.path = a.path "
+                "LEFT JOIN uploads u ON u.backup = b.backup AND u.path = b.path "
+                "WHERE a.backup = ? AND (a.sha256 IS NOT b.sha256 OR a.size != b.size) ORDER BY b.path",
+                (second, first),
+            ).fetchall()),
+        ]
+    finally:
+        conn.close()
+
+    print(f"{first} -> {second}")
+    print(f"База данных: {'без изменений' if found[first] == found[second] else 'изменилась'}")
+    for title, rows in sections:
+        print(f"{title}: {len(rows)} ({megabytes(sum(row[1] for row in rows))})")
+        for path, size, original in rows[:SHOW_LIMIT]:
+            print(f"   {path}" + (f"  ({original})" if original else ""))
+        if len(rows) > SHOW_LIMIT:
+            print(f"   ... и еще {len(rows) - SHOW_LIMIT}")
+    return True
+
+def option_values(args, name):
+    """Значения после каждого вхождения опции: --task 1 --task 2 -> ['1', '2']"""
+    return [args[i + 1] for i, arg in enumerate(args[:-1]) if arg == name]
+
+def int_option_values(args, name):
+    """Целые положительные значения опции; None, если у какого-то вхождения нет числа"""
+    values = option_values(args, name)
+    if len(values) != args.count(name) or not all(value.isdigit() and int(value) > 0 for value in values):
+        return None
+    return [int(value) for value in values]
 
 if __name__ == "__main__":
     import sys
 
     if len(sys.argv) < 2:
         print("Использование:")
-        print("  python backup.py create          - создать бэкап")
+        print("  python backup.py create [--full] [--workers N] - создать бэкап (инкрементальный, если есть предыдущий)")
         print("  python backup.py list            - список бэкапов")
+        print("  python backup.py prune [--dry-run] - удалить старые бэкапы по правилам хранения")
+        print("  python backup.py find <file>     - в каких бэкапах есть файл (путь, имя или файл на диске)")
+        print("  python backup.py diff <a> <b>    - чем бэкап b отличается от a")
         print("  python backup.py restore <file>  - восстановить из бэкапа")
+        print("      [--task ID ...] [--user ID ...] - только файлы заданий / работников")
+        print("      [--target DIR] [--workers N]    - папка для восстановления, число потоков")
+        print("  python backup.py benchmark [МБ] [процессов ...] - скорость сжатия при разном числе процессов")
         sys.exit(1)
 
     command = sys.argv[1]
 
+    args = sys.argv[2:]
+    numbers = {name: int_option_values(args, name) for name in ("--workers", "--task", "--user")}
+    for name, values in numbers.items():
+        if values is None:
+            print(f"Опции {name} нужно целое положительное число: {name} N")
+            sys.exit(1)
+    if "--target" in args and len(option_values(args, "--target")) != args.count("--target"):
+        print("Укажите папку: --target DIR")
+        sys.exit(1)
+    workers = numbers["--workers"][-1] if numbers["--workers"] else BACKUP_WORKERS
+
     if command == "create":
-        create_backup()
+        create_backup(full="--full" in args, workers=workers)
+    elif command == "benchmark":
+        size_mb = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+        benchmark(size_mb, worker_counts=[int(n) for n in sys.argv[3:]])
     elif command == "list":
         list_backups()
+    elif command == "prune":
+        apply_retention(dry_run="--dry-run" in args)
+    elif command == "find":
+        if len(sys.argv) < 3:
+            print("Укажите файл: python backup.py find <file>")
+            sys.exit(1)
+        find_in_backups(sys.argv[2])
+    elif command == "diff":
+        if len(sys.argv) < 4:
+            print("Укажите два бэкапа: python backup.py diff <a> <b>")
+            sys.exit(1)
+        sys.exit(0 if diff_backups(sys.argv[2], sys.argv[3]) else 1)
     elif command == "restore":
         if len(sys.argv) < 3:
             print("Укажите файл бэкапа: python backup.py restore <backup_file.zip>")
             sys.exit(1)
-        restore_backup(sys.argv[2])
+        ok = restore_backup(
+            sys.argv[2],
+            task_ids=numbers["--task"],
+            user_ids=numbers["--user"],
+            target=(option_values(args, "--target") or ["."])[-1],
+            workers=workers,
+        )
+        sys.exit(0 if ok else 1)
     else:
-        print(f"Неизвестная команда: {command}")
\ No newline at end of file
+        print(f"Неизвестная команда: {command}")
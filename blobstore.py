@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Хранилище содержимого файлов с адресацией по SHA-256.
+
+Одинаковый файл, прикрепленный к нескольким заданиям, хранится на диске
+один раз: uploads/blobs/<2 символа>/<sha256>. Записи File ссылаются на Blob,
+у Blob есть счетчик ссылок, и физический файл удаляется только вместе с
+последней ссылкой. Файлы удаляются с диска только после коммита
+транзакции, которая убрала ссылку: при откате они остаются на месте.
+
+Перенос уже загруженных файлов в хранилище:
+  python blobstore.py dedup
+"""
+
+import hashlib
+import os
+import sys
+import uuid
+
+# Добавляем текущую папку в Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import event, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import db, Blob, File
+from thumbnails import remove_previews
+
+BLOCK_SIZE = 64 * 1024
+
+# Ключ session.info со списком файлов, которые удаляются после коммита
+_REMOVE_ON_COMMIT = object()
+
+
+def blob_path(upload_folder, digest):
+    return os.path.join(upload_folder, 'blobs', digest[:2], digest)
+
+
+def file_digest(file_path):
+    """SHA-256 файла на диске"""
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def store_blob(upload_folder, file_path, digest, size):
+    """
+    Кладет записанный файл в хранилище и добавляет ссылку на него.
+
+    Если такое содержимое уже хранится, новый файл удаляется после коммита,
+    иначе переносится в хранилище переименованием (без копирования данных).
+    """
+    blob = _add_reference(digest)
+    if blob is None:
+        path = blob_path(upload_folder, digest)
+        if os.path.exists(path):
+            # Файл последнего удаленного blob стирается после коммита того запроса
+            path = f"{path}.{uuid.uuid4().hex[:8]}"
+        try:
+            with db.session.begin_nested():
+                blob = Blob(digest=digest, file_path=path, size=size, ref_count=1)
+                db.session.add(blob)
+        except IntegrityError:
+            # Такое же содержимое одновременно загрузили в другом запросе
+            return store_blob(upload_folder, file_path, digest, size)
+
+    if os.path.abspath(file_path) == os.path.abspath(blob.file_path):
+        return blob
+    if os.path.exists(blob.file_path):
+        remove_on_commit(file_path)
+    else:
+        os.makedirs(os.path.dirname(blob.file_path), exist_ok=True)
+        os.replace(file_path, blob.file_path)
+    return blob
+
+
+def _add_reference(digest):
+    """
+    Добавляет ссылку на уже хранящееся содержимое и возвращает его Blob.
+    None - такого содержимого нет: UPDATE условный, и если параллельный
+    release_blob уже удалил последнюю ссылку, строки нет и ссылка не добавится.
+    После успешного UPDATE release_blob до коммита этот blob не удалит.
+    """
+    blob = Blob.query.filter_by(digest=digest).first()
+    if blob is None:
+        return None
+    result = db.session.execute(
+        update(Blob)
+        .where(Blob.id == blob.id)
+        .values(ref_count=Blob.ref_count + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        db.session.expunge(blob)
+        return None
+    db.session.expire(blob, ['ref_count'])
+    return blob
+
+
+def remove_on_commit(file_path):
+    """Удаляет файл и его превью с диска после коммита текущей транзакции"""
+    db.session.info.setdefault(_REMOVE_ON_COMMIT, []).append(file_path)
+
+
+def _remove_committed(session):
+    for file_path in session.info.pop(_REMOVE_ON_COMMIT, ()):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        remove_previews(file_path)
+
+
+def _keep_rolled_back(session):
+    session.info.pop(_REMOVE_ON_COMMIT, None)
+
+
+event.listen(Session, 'after_commit', _remove_committed)
+event.listen(Session, 'after_rollback', _keep_rolled_back)
+
+
+def release_blob(blob):
+    """Убирает одну ссылку, при удалении последней удаляет файл после коммита"""
+    blob.ref_count = Blob.ref_count - 1
+    db.session.flush()
+    if blob.ref_count <= 0:
+        remove_on_commit(blob.file_path)
+        db.session.delete(blob)
+
+
+def remove_file(file_record):
+    """Освобождает содержимое записи File перед ее удалением"""
+    if file_record.blob is not None:
+        release_blob(file_record.blob)
+    else:
+        remove_on_commit(file_record.file_path)
+
+
+def dedup_existing(upload_folder):
+    """Переносит файлы, загруженные до появления хранилища, в хранилище"""
+    moved = 0
+    for file_record in File.query.filter(File.blob_id.is_(None)).all():
+        if not os.path.exists(file_record.file_path):
+            print(f"✗ Файл не найден: {file_record.file_path}")
+            continue
+        digest = file_digest(file_record.file_path)
+        blob = store_blob(upload_folder, file_record.file_path, digest, os.path.getsize(file_record.file_path))
+        file_record.blob = blob
+        file_record.checksum = digest
+        file_record.file_path = blob.file_path
+        db.session.commit()
+        moved += 1
+    return moved
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'dedup':
+        print("Использование:")
+        print("  python blobstore.py dedup  - перенести загруженные файлы в хранилище")
+        sys.exit(1)
+
+    from app import app
+
+    with app.app_context():
+        moved = dedup_existing(app.config['UPLOAD_FOLDER'])
+        print(f"✅ Перенесено файлов: {moved}")
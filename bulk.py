@@ -0,0 +1,196 @@
+"""
+Массовое создание заданий.
+
+Строки из JSON или CSV проверяются теми же правилами, что и форма создания
+задания (TaskForm). Если хоть одна строка с ошибкой, ничего не создается и
+возвращается список ошибок по номерам строк. Проверенные строки вставляются
+пачками по TASK_IMPORT_BATCH_SIZE: один INSERT с executemany и коммит на
+пачку, чтобы запись не держала базу заблокированной надолго.
+
+Личное задание для каждого работника создается одним INSERT ... SELECT по
+таблице users, без загрузки работников в Python.
+
+Колонки CSV: title, description, task_type, assigned_to, payment_amount.
+assigned_to - id или логин работника, пусто или 0 - общее задание.
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import insert, literal, select
+from werkzeug.datastructures import MultiDict
+
+from models import db, User, Task
+from forms import TaskForm
+from dashboard import assignee_choices
+
+TASK_COLUMNS = ('title', 'description', 'task_type', 'assigned_to', 'payment_amount')
+
+# Значение assigned_to в форме создания: личное задание каждому работнику
+EVERY_EMPLOYEE = -1
+
+
+class TaskImportError(Exception):
+    """Ошибки проверки строк: список (номер строки, {поле: [сообщения]})"""
+
+    def __init__(self, message, rows=None):
+        super().__init__(message)
+        self.rows = rows or []
+
+
+def parse_rows(content, kind):
+    """Строки из тела JSON ([...] или {"tasks": [...]}) или CSV; kind - 'json' или 'csv'"""
+    if isinstance(content, bytes):
+        try:
+            content = content.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise TaskImportError('Файл должен быть в кодировке UTF-8')
+    if kind == 'csv':
+        return read_csv(content)
+    try:
+        data = json.loads(content)
+    except ValueError:
+        raise TaskImportError('Некорректный JSON')
+    if isinstance(data, dict):
+        data = data.get('tasks')
+    if not isinstance(data, list):
+        raise TaskImportError('Ожидается список заданий или {"tasks": [...]}')
+    return data
+
+
+def read_csv(text):
+    """Строки CSV как словари; разделитель определяется автоматически (',' или ';')"""
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;')
+    except csv.Error:
+        dialect = csv.excel
+    return list(csv.DictReader(io.StringIO(text), dialect=dialect))
+
+
+def _usernames():
+    return dict(db.session.query(User.username, User.id).filter_by(is_admin=False))
+
+
+def _form_data(row, usernames):
+    data = MultiDict()
+    for column in TASK_COLUMNS:
+        value = row.get(column)
+        if value is None:
+            value = ''
+        value = str(value).strip()
+        if column == 'assigned_to':
+            if value in usernames:
+                value = str(usernames[value])
+            elif not value:
+                value = '0'
+        elif column == 'payment_amount' and not value:
+            # Пустая сумма - без оплаты, а не ошибка FloatField
+            continue
+        data[column] = value
+    return data
+
+
+def _errors(form):
+    return {name: list(messages) for name, messages in form.errors.items()}
+
+
+def task_values(form, created_by, now=None):
+    """Значения колонок tasks из проверенной TaskForm"""
+    now = now or datetime.utcnow()
+    return {
+        'title': form.title.data,
+        'description': form.description.data,
+        'task_type': form.task_type.data,
+        'payment_amount': form.payment_amount.data if form.payment_amount.data else None,
+        'assigned_to': None if form.assigned_to.data == 0 else form.assigned_to.data,
+        'created_by': created_by,
+        'created_at': now,
+        'updated_at': now,
+    }
+
+
+def validate_rows(rows, created_by):
+    """
+    Проверяет строки по правилам TaskForm и возвращает словари для вставки
+    в tasks. При ошибках бросает TaskImportError со списком ошибок по строкам.
+    """
+    if not rows:
+        raise TaskImportError('Нет строк для импорта')
+    max_rows = current_app.config['TASK_IMPORT_MAX_ROWS']
+    if len(rows) > max_rows:
+        raise TaskImportError(f'Не больше {max_rows} строк за один импорт')
+
+    choices = assignee_choices()
+    usernames = _usernames()
+    now = datetime.utcnow()
+    values, errors = [], []
+    for number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append((number, {'row': ['Строка должна быть объектом']}))
+            continue
+        form = TaskForm(formdata=_form_data(row, usernames), meta={'csrf': False})
+        form.assigned_to.choices = choices
+        if not form.validate():
+            errors.append((number, _errors(form)))
+            continue
+        values.append(task_values(form, created_by, now))
+
+    if errors:
+        raise TaskImportError(f'Ошибки в строках: {len(errors)}', errors)
+    return values
+
+
+def insert_tasks(values):
+    """Вставляет проверенные строки пачками, возвращает число созданных заданий"""
+    batch_size = current_app.config['TASK_IMPORT_BATCH_SIZE']
+    for start in range(0, len(values), batch_size):
+        db.session.execute(insert(Task), values[start:start + batch_size])
+        db.session.commit()
+    return len(values)
+
+
+def import_tasks(rows, created_by):
+    return insert_tasks(validate_rows(rows, created_by))
+
+
+def validate_fan_out(data, created_by):
+    """Проверяет задание для всех работников (title, description, payment_amount) по правилам TaskForm"""
+    form = TaskForm(formdata=_form_data(dict(data, task_type='personal', assigned_to=''), {}),
+                    meta={'csrf': False})
+    form.assigned_to.choices = [(0, '')]
+    if not form.validate():
+        raise TaskImportError('Ошибки в задании', [(1, _errors(form))])
+    return task_values(form, created_by)
+
+
+def fan_out_personal_task(values, employee_ids=None):
+    """
+    Создает одинаковое личное задание каждому работнику (или работникам из
+    employee_ids) одним INSERT ... SELECT. Возвращает число созданных заданий.
+    """
+    employees = select(
+        literal(values['title']),
+        literal(values['description']),
+        literal('personal'),
+        literal('active'),
+        literal(values['payment_amount'], Task.payment_amount.type),
+        literal(False),
+        literal(values['created_at']),
+        literal(values['updated_at']),
+        literal(0),
+        literal(0),
+        User.id,
+        literal(values['created_by']),
+    ).where(User.is_admin == False)
+    if employee_ids is not None:
+        employees = employees.where(User.id.in_(employee_ids))
+
+    result = db.session.execute(insert(Task).from_select([
+        'title', 'description', 'task_type', 'status', 'payment_amount', 'is_paid',
+        'created_at', 'updated_at', 'file_count', 'comment_count', 'assigned_to', 'created_by',
+    ], employees))
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,93 @@
+"""
+Небольшой кэш в памяти процесса с ограничением размера (LRU) и временем жизни.
+
+invalidate_on_commit() связывает кэш с моделью: записи добавленных,
+измененных или удаленных объектов выбрасываются после коммита транзакции,
+а не во время flush, чтобы параллельный запрос не успел положить в кэш
+старые данные.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def generation(self):
+        """
+        Номер сброса кэша. Значение, прочитанное из базы после generation(),
+        передается в set(..., generation=...) и не записывается, если между
+        чтением и записью был delete() или clear().
+        """
+        return self._generation
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._generation += 1
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def invalidate_on_commit(model, invalidate, key=lambda target: target.id):
+    """
+    После коммита вызывает invalidate(key(объект)) для каждого объекта model,
+    добавленного, измененного или удаленного в транзакции.
+    invalidate - функция или кэш (тогда используется cache.delete).
+    """
+    if hasattr(invalidate, 'delete'):
+        invalidate = invalidate.delete
+    info_key = object()
+
+    def mark_changed(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault(info_key, set()).add(key(target))
+
+    def drop_changed(session):
+        for changed_key in session.info.pop(info_key, ()):
+            invalidate(changed_key)
+
+    event.listen(model, 'after_insert', mark_changed)
+    event.listen(model, 'after_update', mark_changed)
+    event.listen(model, 'after_delete', mark_changed)
+    # После отката лишнее удаление из кэша безвредно
+    event.listen(Session, 'after_commit', drop_changed)
+    event.listen(Session, 'after_rollback', drop_changed)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Проверка отдачи файлов при скачивании.
+
+На временной базе и папке загрузок скачивается файл задания во всех
+режимах FILE_SERVING_MODE. В режимах x-accel и x-sendfile приложение должно
+вернуть пустой ответ с путем для прокси и Content-Disposition, в режиме
+direct - сам файл с ответами 206 на Range и 304 на условные запросы.
+
+Использование:
+  python check_file_serving.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+# Добавляем текущую папку в Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Проверка никогда не трогает рабочую базу и папку загрузок
+_work_dir = tempfile.mkdtemp(prefix='check_files_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_work_dir, 'check.db')}"
+
+from app import app
+from models import db, User, Task, File
+
+ORIGINAL_FILENAME = 'Отчет за май.pdf'
+CONTENT = bytes(range(256)) * 40
+
+
+def seed():
+    """Администратор, задание и файл на диске. Возвращает (id администратора, id файла, путь)"""
+    upload_folder = app.config['UPLOAD_FOLDER']
+    os.makedirs(os.path.join(upload_folder, 'blobs', 'ab'), exist_ok=True)
+    file_path = os.path.join(upload_folder, 'blobs', 'ab', 'report.pdf')
+    with open(file_path, 'wb') as f:
+        f.write(CONTENT)
+
+    db.drop_all()
+    db.create_all()
+    admin = User(username='admin', email='admin@example.com', full_name='Администратор',
+                 password_hash='-', is_admin=True)
+    db.session.add(admin)
+    db.session.flush()
+    task = Task(title='Задание', task_type='general', created_by=admin.id)
+    db.session.add(task)
+    db.session.flush()
+    file_record = File(filename='report.pdf', original_filename=ORIGINAL_FILENAME,
+                       file_path=file_path, file_size=len(CONTENT), mime_type='application/pdf',
+                       task_id=task.id, uploaded_by=admin.id)
+    db.session.add(file_record)
+    db.session.commit()
+    return admin.id, file_record.id, file_path
+
+
+def logged_in(user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+
+def check(results, name, ok, details=''):
+    print(f"{'✓' if ok else '✗'} {name}{f' - {details}' if details else ''}")
+    results.append(ok)
+
+
+def check_attachment(results, mode, response):
+    disposition = response.headers.get('Content-Disposition', '')
+    check(results, f'{mode}: Content-Disposition', disposition.startswith('attachment')
+          and "filename*=UTF-8''" in disposition, disposition)
+
+
+def check_proxy_modes(results, client, url, file_path):
+    prefix = app.config['X_ACCEL_PREFIX'].rstrip('/')
+
+    app.config['FILE_SERVING_MODE'] = 'x-accel'
+    response = client.get(url)
+    redirect = response.headers.get('X-Accel-Redirect', '')
+    check(results, 'x-accel: статус 200', response.status_code == 200, str(response.status_code))
+    check(results, 'x-accel: путь X-Accel-Redirect', redirect == f'{prefix}/blobs/ab/report.pdf', redirect)
+    check(results, 'x-accel: пустое тело', response.data == b'', f'{len(response.data)} байт')
+    check_attachment(results, 'x-accel', response)
+
+    app.config['FILE_SERVING_MODE'] = 'x-sendfile'
+    response = client.get(url)
+    sendfile = response.headers.get('X-Sendfile', '')
+    check(results, 'x-sendfile: путь X-Sendfile', sendfile == os.path.abspath(file_path), sendfile)
+    check(results, 'x-sendfile: пустое тело', response.data == b'', f'{len(response.data)} байт')
+    check_attachment(results, 'x-sendfile', response)
+
+
+def check_direct_mode(results, client, url):
+    app.config['FILE_SERVING_MODE'] = 'direct'
+    response = client.get(url)
+    check(results, 'direct: файл целиком', response.status_code == 200 and response.data == CONTENT,
+          str(response.status_code))
+    check(results, 'direct: Accept-Ranges', response.headers.get('Accept-Ranges') == 'bytes')
+    check_attachment(results, 'direct', response)
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+
+    response = client.get(url, headers={'Range': 'bytes=100-199'})
+    content_range = response.headers.get('Content-Range', '')
+    check(results, 'direct: Range - 206 и часть файла', response.status_code == 206
+          and response.data == CONTENT[100:200] and content_range == f'bytes 100-199/{len(CONTENT)}',
+          f'{response.status_code}, {content_range}')
+
+    response = client.get(url, headers={'Range': 'bytes=100-199', 'If-Range': '"other"'})
+    check(results, 'direct: If-Range с чужим ETag - файл целиком', response.status_code == 200,
+          str(response.status_code))
+
+    response = client.get(url, headers={'If-None-Match': etag})
+    check(results, 'direct: If-None-Match - 304', response.status_code == 304 and response.data == b'',
+          str(response.status_code))
+
+    response = client.get(url, headers={'If-Modified-Since': last_modified})
+    check(results, 'direct: If-Modified-Since - 304', response.status_code == 304,
+          str(response.status_code))
+
+
+def check_file_serving():
+    """Печатает результаты и возвращает количество проваленных проверок"""
+    app.config['UPLOAD_FOLDER'] = os.path.join(_work_dir, 'uploads')
+    with app.app_context():
+        admin_id, file_id, file_path = seed()
+
+    client = logged_in(admin_id)
+    url = f'/file/{file_id}/download'
+    mode = app.config['FILE_SERVING_MODE']
+    results = []
+    try:
+        check_proxy_modes(results, client, url, file_path)
+        check_direct_mode(results, client, url)
+    finally:
+        app.config['FILE_SERVING_MODE'] = mode
+    return results.count(False)
+
+
+if __name__ == '__main__':
+    try:
+        failures = check_file_serving()
+    finally:
+        shutil.rmtree(_work_dir, ignore_errors=True)
+
+    if failures:
+        print(f"❌ Проваленных проверок: {failures}")
+        sys.exit(1)
+    print("✅ Файлы отдаются правильно во всех режимах")
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Проверка числа SQL запросов на страницах с заданиями.
+
+Страницы открываются на временной базе с разным количеством заданий,
+файлов и комментариев. Число запросов должно быть одинаковым (нет N+1)
+и не больше заданного предела - и с пустым кэшем карточек, и с заполненным.
+
+Использование:
+  python check_queries.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+# Добавляем текущую папку в Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Проверка никогда не трогает рабочую базу
+_work_dir = tempfile.mkdtemp(prefix='check_queries_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_work_dir, 'check.db')}"
+
+from sqlalchemy import event
+
+from app import app, fragment_cache
+from models import db, User, Task, File, Comment
+
+# Размеры данных: одна неполная страница и больше страницы
+SIZES = (5, 60)
+
+# Наибольшее допустимое число запросов на страницу
+QUERY_LIMITS = {
+    'admin_dashboard': 12,
+    'employee_dashboard': 10,
+    'view_employee_profile': 10,
+}
+
+
+def seed(task_count):
+    """Пустая база: работники, личные и общие задания, у каждого файлы и комментарии"""
+    db.drop_all()
+    db.create_all()
+    admin = User(username='admin', email='admin@example.com', full_name='Администратор',
+                 password_hash='-', is_admin=True)
+    employees = [User(username=f'employee{i}', email=f'employee{i}@example.com',
+                      full_name=f'Работник {i}', password_hash='-') for i in range(3)]
+    db.session.add_all([admin] + employees)
+    db.session.flush()
+
+    for i in range(task_count):
+        employee = employees[i % len(employees)]
+        general = i % 2
+        task = Task(title=f'Задание {i}', description='Описание задания',
+                    task_type='general' if general else 'personal',
+                    assigned_to=None if general else employee.id, created_by=admin.id)
+        db.session.add(task)
+        db.session.flush()
+        for author in employees[:2]:
+            db.session.add(File(filename=f'file{i}.txt', original_filename=f'file{i}.txt',
+                                file_path=f'uploads/file{i}.txt', file_size=1,
+                                task_id=task.id, uploaded_by=author.id))
+            db.session.add(Comment(content='Комментарий', task_id=task.id, user_id=author.id))
+    db.session.commit()
+    return admin.id, employees[0].id
+
+
+def count_queries(client, url):
+    """Статус ответа и число выполненных SQL запросов"""
+    count = 0
+
+    def before_cursor_execute(*args):
+        nonlocal count
+        count += 1
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        status = client.get(url).status_code
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return status, count
+
+
+def logged_in(user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+
+def measure(task_count):
+    """{страница: (запросов с пустым кэшем, запросов с заполненным)}"""
+    with app.app_context():
+        admin_id, employee_id = seed(task_count)
+
+    pages = {
+        'admin_dashboard': (admin_id, '/admin'),
+        'employee_dashboard': (employee_id, '/employee'),
+        'view_employee_profile': (admin_id, f'/admin/user/{employee_id}'),
+    }
+    results = {}
+    for name, (user_id, url) in pages.items():
+        client = logged_in(user_id)
+        fragment_cache.clear()
+        cold_status, cold = count_queries(client, url)
+        warm_status, warm = count_queries(client, url)
+        if cold_status != 200 or warm_status != 200:
+            raise RuntimeError(f'{url}: ответ {cold_status}/{warm_status}')
+        results[name] = (cold, warm)
+    return results
+
+
+def check_query_counts():
+    """Печатает число запросов и возвращает количество страниц с ошибками"""
+    measured = {size: measure(size) for size in SIZES}
+    failures = 0
+    for name, limit in QUERY_LIMITS.items():
+        counts = [measured[size][name] for size in SIZES]
+        constant = len(set(counts)) == 1
+        within_limit = max(max(pair) for pair in counts) <= limit
+        ok = constant and within_limit
+        details = ', '.join(f'{size} заданий: {cold}/{warm}' for size, (cold, warm) in zip(SIZES, counts))
+        print(f"{'✓' if ok else '✗'} {name} (не больше {limit}) - запросов без кэша/с кэшем: {details}")
+        if not constant:
+            print("    число запросов растет вместе с числом заданий")
+        if not ok:
+            failures += 1
+    return failures
+
+
+if __name__ == '__main__':
+    try:
+        failures = check_query_counts()
+    finally:
+        shutil.rmtree(_work_dir, ignore_errors=True)
+
+    if failures:
+        print(f"❌ Страниц с лишними запросами: {failures}")
+        sys.exit(1)
+    print("✅ Число запросов не зависит от количества заданий")
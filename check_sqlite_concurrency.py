@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Проверка профиля PRAGMA SQLite под параллельной записью.
+
+Несколько процессов (как воркеры Gunicorn) одновременно добавляют
+комментарии и обновляют счетчик задания во временной файловой базе, еще
+один процесс все это время читает. С профилем production (WAL,
+busy_timeout) не должно быть ни одной ошибки "database is locked", и все
+записи должны оказаться в базе.
+
+Использование:
+  python check_sqlite_concurrency.py [профиль] [процессов] [записей на процесс]
+"""
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Добавляем текущую папку в Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, func, insert, select, update
+from sqlalchemy.exc import OperationalError
+
+from config import Config
+from models import db, setup_sqlite_pragmas, User, Task, Comment
+
+WRITERS = 6
+WRITES_PER_WRITER = 200
+
+
+def connect(db_url, profile):
+    # Без собственного ожидания драйвера sqlite3 (timeout=5 с): проверяется только busy_timeout профиля
+    engine = create_engine(db_url, connect_args={'timeout': 0})
+    setup_sqlite_pragmas(engine, Config.SQLITE_PRAGMA_PROFILES[profile])
+    return engine
+
+
+def prepare(db_url, profile):
+    """Схема, один работник и одно задание"""
+    engine = connect(db_url, profile)
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User).values(id=1, username='employee', email='employee@example.com',
+                                         full_name='Работник', password_hash='-'))
+        conn.execute(insert(Task).values(id=1, title='Задание', task_type='general', created_by=1))
+    engine.dispose()
+
+
+def is_locked(error):
+    return 'database is locked' in str(error)
+
+
+def writer(db_url, profile, number, writes, results):
+    """Как запрос с комментарием: чтение задания, вставка и обновление счетчика в одной транзакции"""
+    engine = connect(db_url, profile)
+    locked = 0
+    for i in range(writes):
+        try:
+            with engine.begin() as conn:
+                conn.execute(select(Task.id).where(Task.id == 1)).one()
+                conn.execute(insert(Comment).values(content=f'{number}:{i}', task_id=1, user_id=1))
+                conn.execute(update(Task).where(Task.id == 1)
+                             .values(comment_count=Task.comment_count + 1))
+        except OperationalError as e:
+            if not is_locked(e):
+                raise
+            locked += 1
+    engine.dispose()
+    results.put(('writer', locked))
+
+
+def reader(db_url, profile, stop, results):
+    engine = connect(db_url, profile)
+    locked = 0
+    reads = 0
+    while not stop.is_set():
+        try:
+            with engine.connect() as conn:
+                conn.execute(select(func.count(Comment.id))).scalar()
+            reads += 1
+        except OperationalError as e:
+            if not is_locked(e):
+                raise
+            locked += 1
+    engine.dispose()
+    results.put(('reader', locked, reads))
+
+
+def check_concurrency(profile='production', writers=WRITERS, writes=WRITES_PER_WRITER):
+    """Печатает результат и возвращает число ошибок блокировки"""
+    work_dir = tempfile.mkdtemp(prefix='check_sqlite_')
+    db_url = f"sqlite:///{os.path.join(work_dir, 'check.db')}"
+    try:
+        prepare(db_url, profile)
+        results = multiprocessing.Queue()
+        stop = multiprocessing.Event()
+        read_process = multiprocessing.Process(target=reader, args=(db_url, profile, stop, results))
+        write_processes = [
+            multiprocessing.Process(target=writer, args=(db_url, profile, number, writes, results))
+            for number in range(writers)
+        ]
+
+        started = time.perf_counter()
+        read_process.start()
+        for process in write_processes:
+            process.start()
+        outcomes = [results.get() for _ in write_processes]
+        stop.set()
+        outcomes.append(results.get())
+        elapsed = time.perf_counter() - started
+        for process in write_processes + [read_process]:
+            process.join()
+        if any(process.exitcode for process in write_processes + [read_process]):
+            raise RuntimeError('Процесс проверки завершился с ошибкой')
+
+        write_locked = sum(outcome[1] for outcome in outcomes if outcome[0] == 'writer')
+        _, read_locked, reads = next(outcome for outcome in outcomes if outcome[0] == 'reader')
+        engine = connect(db_url, profile)
+        with engine.connect() as conn:
+            comments = conn.execute(select(func.count(Comment.id))).scalar()
+            counter = conn.execute(select(Task.comment_count).where(Task.id == 1)).scalar()
+        engine.dispose()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    expected = writers * writes - write_locked
+    print(f"Профиль: {profile}, писателей: {writers} x {writes} транзакций, {elapsed:.1f} с")
+    print(f"   ошибок 'database is locked': запись {write_locked}, чтение {read_locked} (чтений: {reads})")
+    print(f"   комментариев в базе: {comments}, счетчик задания: {counter}, ожидалось: {expected}")
+    if comments != expected or counter != expected:
+        raise RuntimeError('Записи потеряны')
+    return write_locked + read_locked
+
+
+if __name__ == '__main__':
+    profile = sys.argv[1] if len(sys.argv) > 1 else 'production'
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else WRITERS
+    writes = int(sys.argv[3]) if len(sys.argv) > 3 else WRITES_PER_WRITER
+    if profile not in Config.SQLITE_PRAGMA_PROFILES:
+        print(f"Неизвестный профиль: {profile} (есть: {', '.join(Config.SQLITE_PRAGMA_PROFILES)})")
+        sys.exit(1)
+
+    locked = check_concurrency(profile, writers, writes)
+    if locked:
+        print(f"❌ Ошибок блокировки базы: {locked}")
+        sys.exit(1)
+    print("✅ Параллельная запись без ошибок блокировки")
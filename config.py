@@ -4,13 +4,73 @@ from datetime import timedelta
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///./task_manager.db'
+    # Heroku задает адрес postgres://, SQLAlchemy 2.0 принимает только postgresql://
+    if SQLALCHEMY_DATABASE_URI.startswith('postgres://'):
+        SQLALCHEMY_DATABASE_URI = 'postgresql://' + SQLALCHEMY_DATABASE_URI[len('postgres://'):]
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    
+    # Профиль PRAGMA для каждого нового соединения SQLite:
+    # production - WAL, читатели не блокируют писателей; default - настройки SQLite
+    SQLITE_PRAGMA_PROFILE = os.environ.get('SQLITE_PRAGMA_PROFILE') or 'production'
+    SQLITE_PRAGMA_PROFILES = {
+        'default': {},
+        'production': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),  # мс
+            'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -20000)),  # отрицательное - в КиБ
+            'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+            'temp_store': 'MEMORY',
+        },
+    }
     PERMANENT_SESSION_LIFETIME = timedelta(hours=24)
     
+    # Массовый импорт заданий: строк за один импорт и строк в одной транзакции
+    TASK_IMPORT_MAX_ROWS = 5000
+    TASK_IMPORT_BATCH_SIZE = 500
+    
+    # Кэш отрендеренных карточек заданий: в памяти процесса или общий Redis (redis://...)
+    FRAGMENT_CACHE_URL = os.environ.get('FRAGMENT_CACHE_URL') or ''
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 5000))
+    FRAGMENT_CACHE_TTL = 24 * 3600
+    
+    # Хеширование паролей в формате Werkzeug: scrypt:N:r:p или pbkdf2:sha256:итерации.
+    # Подобрать параметры: python hashing.py benchmark
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt:32768:8:1'
+    # Каждый хеш и каждый ожидающий в очереди держит поток запроса, поэтому вместе
+    # они занимают не больше REQUEST_THREADS - 1 потоков воркера, лишние входы сразу получают 503
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))  # Одновременных хешей на процесс
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 1))  # Сверх этого - отказ
+    REQUEST_THREADS = int(os.environ.get('GUNICORN_THREADS', 4))  # Потоков в воркере (gunicorn.conf.py)
+    
+    # Кэш пользователей для Flask-Login: строка users не загружается на каждый запрос.
+    # Изменения и удаление пользователя в другом воркере видны не позже чем через
+    # USER_CACHE_TTL секунд, в своем процессе - сразу после коммита (см. load_user в app.py)
+    USER_CACHE_SIZE = 1024
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 10))
+    
+    # Постраничный вывод заданий
+    TASKS_PER_PAGE = int(os.environ.get('TASKS_PER_PAGE', 20))
+    MAX_TASKS_PER_PAGE = 100
+    
     # Папка для загружаемых файлов
     UPLOAD_FOLDER = 'uploads'
     MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # 100MB максимальный размер файла
     
+    # Загрузка частями: размер файла ограничен отдельно, каждый кусок - MAX_CONTENT_LENGTH
+    MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', 1024 * 1024 * 1024))  # 1GB
+    UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024  # Рекомендуемый размер куска для клиента
+    # Через сколько часов без новых кусков загрузка и ее файл удаляются
+    UPLOAD_EXPIRE_HOURS = int(os.environ.get('UPLOAD_EXPIRE_HOURS', 24))
+    
+    # Потоки фоновой генерации превью изображений
+    PREVIEW_WORKERS = int(os.environ.get('PREVIEW_WORKERS', 2))
+    
+    # Кто отдает файлы при скачивании: direct - сам Flask,
+    # x-accel - nginx (X-Accel-Redirect), x-sendfile - Apache/lighttpd (X-Sendfile)
+    FILE_SERVING_MODE = os.environ.get('FILE_SERVING_MODE') or 'direct'
+    X_ACCEL_PREFIX = os.environ.get('X_ACCEL_PREFIX') or '/protected-uploads/'
+    
     # Разрешенные расширения файлов
     ALLOWED_EXTENSIONS = {
         # Изображения
@@ -0,0 +1,199 @@
+"""
+Слой доступа к данным для панелей с заданиями.
+
+Шаблоны обходят task.assignee, task.files, file.uploader, task.comments и
+comment.author для каждого задания. Без предзагрузки каждое обращение -
+отдельный SELECT, поэтому все списки заданий строятся здесь с фиксированным
+числом запросов независимо от количества заданий.
+
+Итоговые цифры (количество, суммы оплаты) считаются агрегатными запросами
+в базе, а не суммированием загруженных объектов в Python.
+
+Списки заданий выдаются постранично по ключу (created_at, id): следующая
+страница начинается строго после последнего показанного задания, поэтому
+время выборки не зависит от номера страницы, в отличие от OFFSET.
+"""
+
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import case, func, tuple_
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import db, User, Task, File, Comment
+
+
+def task_card_options(details=True):
+    """
+    Стратегии загрузки связей, которые нужны карточке задания.
+    Без details карточка показывает только счетчики file_count/comment_count,
+    и файлы с комментариями не загружаются.
+    """
+    if not details:
+        return (joinedload(Task.assignee),)
+    return (
+        joinedload(Task.assignee),
+        selectinload(Task.files).joinedload(File.uploader),
+        selectinload(Task.comments).joinedload(Comment.author),
+    )
+
+
+def load_task_details(tasks):
+    """Догружает файлы и комментарии (с авторами) для уже загруженных заданий"""
+    if tasks:
+        Task.query.filter(Task.id.in_([task.id for task in tasks])).options(*task_card_options()).all()
+
+
+def admin_tasks_query():
+    """Все задания для админ панели"""
+    return Task.query
+
+
+def personal_tasks_query(user_id):
+    """Личные задания работника"""
+    return Task.query.filter_by(assigned_to=user_id, task_type='personal')
+
+
+def general_tasks_query():
+    """Общие задания"""
+    return Task.query.filter_by(task_type='general')
+
+
+def get_employees():
+    """Список работников (без администраторов)"""
+    return User.query.filter_by(is_admin=False).all()
+
+
+def assignee_choices():
+    """Варианты назначения задания: общее или конкретный работник (только id и имя)"""
+    employees = db.session.query(User.id, User.full_name).filter_by(is_admin=False).order_by(User.full_name)
+    return [(0, 'Общее задание (для всех)')] + [(user_id, full_name) for user_id, full_name in employees]
+
+
+def count_tasks(query):
+    """Количество заданий в выборке одним COUNT запросом"""
+    return query.order_by(None).with_entities(func.count(Task.id)).scalar()
+
+
+def encode_cursor(task):
+    """Курсор страницы: время создания и id задания"""
+    return f"{task.created_at.isoformat()}_{task.id}"
+
+
+def decode_cursor(cursor):
+    """Разбирает курсор, для некорректного значения возвращает None"""
+    if not cursor:
+        return None
+    try:
+        created_at, task_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(task_id)
+    except ValueError:
+        return None
+
+
+class TaskPage:
+    """Одна страница заданий и курсоры соседних страниц"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.next_url = None
+        self.prev_url = None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def paginate_tasks(query, after=None, before=None, limit=None, details=True):
+    """
+    Возвращает страницу заданий, отсортированных от новых к старым.
+
+    after - курсор последнего задания предыдущей страницы (переход вперед),
+    before - курсор первого задания следующей страницы (переход назад),
+    details - загружать файлы и комментарии (см. task_card_options).
+    """
+    per_page = current_app.config['TASKS_PER_PAGE']
+    max_per_page = current_app.config['MAX_TASKS_PER_PAGE']
+    limit = min(max(limit or per_page, 1), max_per_page)
+
+    key = tuple_(Task.created_at, Task.id)
+    after = decode_cursor(after)
+    before = decode_cursor(before) if after is None else None
+
+    query = query.options(*task_card_options(details))
+    if before is not None:
+        rows = (query.filter(key > tuple_(*before))
+                .order_by(Task.created_at.asc(), Task.id.asc())
+                .limit(limit + 1).all())
+        has_prev = len(rows) > limit
+        items = list(reversed(rows[:limit]))
+        has_next = True
+    else:
+        if after is not None:
+            query = query.filter(key < tuple_(*after))
+        rows = (query.order_by(Task.created_at.desc(), Task.id.desc())
+                .limit(limit + 1).all())
+        has_next = len(rows) > limit
+        items = rows[:limit]
+        has_prev = after is not None
+
+    if not items:
+        return TaskPage(items)
+    return TaskPage(
+        items,
+        next_cursor=encode_cursor(items[-1]) if has_next else None,
+        prev_cursor=encode_cursor(items[0]) if has_prev else None,
+    )
+
+
+def get_dashboard_stats():
+    """Общая статистика для шапки админ панели, считается на стороне SQL"""
+    paid_amount = case((Task.is_paid == True, Task.payment_amount), else_=0)
+    row = db.session.query(
+        func.count(Task.id),
+        func.coalesce(func.sum(Task.payment_amount), 0),
+        func.coalesce(func.sum(case((Task.is_paid == True, 1), else_=0)), 0),
+        func.coalesce(func.sum(paid_amount), 0),
+    ).one()
+    tasks_count, total_payment, paid_tasks, paid_payment = row
+
+    employees_count = db.session.query(func.count(User.id)).filter(User.is_admin == False).scalar()
+
+    return {
+        'employees': employees_count,
+        'tasks': tasks_count,
+        'total_payment': total_payment,
+        'paid_tasks': paid_tasks,
+        'unpaid_tasks': tasks_count - paid_tasks,
+        'paid_payment': paid_payment,
+        'unpaid_payment': total_payment - paid_payment,
+    }
+
+
+def get_employee_totals(user_id=None):
+    """Количество заданий и суммы оплаты по работникам одним GROUP BY запросом"""
+    paid_amount = case((Task.is_paid == True, Task.payment_amount), else_=0)
+    query = db.session.query(
+        Task.assigned_to,
+        func.count(Task.id),
+        func.coalesce(func.sum(Task.payment_amount), 0),
+        func.coalesce(func.sum(paid_amount), 0),
+    ).filter(Task.assigned_to.isnot(None)).group_by(Task.assigned_to)
+    if user_id is not None:
+        query = query.filter(Task.assigned_to == user_id)
+
+    totals = {}
+    for assigned_to, tasks_count, total_payment, paid_payment in query:
+        totals[assigned_to] = {
+            'tasks': tasks_count,
+            'total_payment': total_payment,
+            'paid_payment': paid_payment,
+            'unpaid_payment': total_payment - paid_payment,
+        }
+    return totals
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Проверка планов запросов: EXPLAIN QUERY PLAN для выборок, которые делают
+страницы приложения, и проверка того, что они используют индексы.
+
+Использование:
+  python explain_queries.py
+"""
+
+import os
+import sys
+from datetime import datetime
+
+# Добавляем текущую папку в Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import tuple_
+
+from app import app
+from models import db, Task, File, Comment
+from dashboard import admin_tasks_query, personal_tasks_query, general_tasks_query
+
+CURSOR = (datetime(2000, 1, 1), 1)
+
+
+def _page(query):
+    """Выборка страницы заданий так же, как ее строит paginate_tasks"""
+    return (query.filter(tuple_(Task.created_at, Task.id) < tuple_(*CURSOR))
+            .order_by(Task.created_at.desc(), Task.id.desc())
+            .limit(21))
+
+
+def route_queries():
+    """(страница, запрос, индекс, который должен использоваться)"""
+    return [
+        ('admin_dashboard', _page(admin_tasks_query()), 'ix_tasks_created'),
+        ('employee_dashboard: личные', _page(personal_tasks_query(1)), 'ix_tasks_assigned_type_created'),
+        ('employee_dashboard: общие', _page(general_tasks_query()), 'ix_tasks_type_created'),
+        ('view_task: комментарии',
+         Comment.query.filter_by(task_id=1).order_by(Comment.created_at), 'ix_comments_task_created'),
+        ('view_task: файлы',
+         File.query.filter_by(task_id=1).order_by(File.uploaded_at.desc()), 'ix_files_task_uploaded'),
+        ('карточки: файлы заданий',
+         File.query.filter(File.task_id.in_([1, 2, 3])), 'ix_files_task_uploaded'),
+        ('карточки: комментарии заданий',
+         Comment.query.filter(Comment.task_id.in_([1, 2, 3])), 'ix_comments_task_created'),
+    ]
+
+
+def explain(query):
+    """Строки EXPLAIN QUERY PLAN для запроса SQLAlchemy"""
+    compiled = query.statement.compile(dialect=db.engine.dialect,
+                                       compile_kwargs={'render_postcompile': True})
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    rows = db.session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)
+    return [row[-1] for row in rows]
+
+
+def check_plans():
+    """Печатает планы и возвращает количество запросов без нужного индекса"""
+    failures = 0
+    for name, query, index in route_queries():
+        plan = explain(query)
+        uses_index = any(f"INDEX {index}" in line for line in plan)
+        sorts = any('TEMP B-TREE' in line for line in plan)
+        ok = uses_index and not sorts
+        print(f"{'✓' if ok else '✗'} {name} ({index})")
+        for line in plan:
+            print(f"    {line}")
+        if not ok:
+            failures += 1
+    return failures
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        failures = check_plans()
+
+    if failures:
+        print(f"❌ Запросов без индекса: {failures}")
+        sys.exit(1)
+    print("✅ Все запросы используют индексы")
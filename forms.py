@@ -1,4 +1,5 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, PasswordField, BooleanField, TextAreaField, SelectField, FloatField, SubmitField
 from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError
 from models import User
@@ -36,6 +37,10 @@ class TaskForm(FlaskForm):
     payment_amount = FloatField('Сумма оплаты (только для админа)')
     submit = SubmitField('Создать задание')
 
+class TaskImportForm(FlaskForm):
+    file = FileField('Файл CSV или JSON', validators=[FileRequired(), FileAllowed(['csv', 'json'], 'Только файлы CSV или JSON')])
+    submit = SubmitField('Импортировать')
+
 class CommentForm(FlaskForm):
     content = TextAreaField('Комментарий', validators=[DataRequired(), Length(min=1, max=1000)])
     submit = SubmitField('Добавить комментарий')
\ No newline at end of file
@@ -0,0 +1,158 @@
+"""
+Кэш отрендеренных карточек заданий.
+
+Карточка задания на админ панели, панели работника и в профиле рендерится
+из отдельного шаблона (task_card_<вариант>.html) и сохраняется в кэше вместе
+с подписью (task.updated_at, число файлов и комментариев, версия таблицы
+users). Совпала подпись - HTML берется из кэша, поэтому время рендера панели
+зависит от числа изменившихся заданий, а не от общего числа заданий.
+
+Версия users (последний updated_at и число пользователей) читается одним
+запросом на запрос страницы, поэтому переименование пользователя в любом
+процессе меняет подписи всех карточек с именами. Изменения Task, File и
+Comment дополнительно сбрасывают карточки своего задания после коммита.
+
+preload() проверяет кэш до рендера страницы, чтобы файлы и комментарии
+загружались только для карточек, которые придется рендерить.
+
+Хранилище: по умолчанию LRU в памяти процесса; FRAGMENT_CACHE_URL=redis://...
+включает общий для всех воркеров Redis (нужен пакет redis).
+"""
+
+from flask import g
+from markupsafe import Markup
+from sqlalchemy import func
+
+from cache import TTLCache, invalidate_on_commit
+from models import db, User, Task, File, Comment
+
+VARIANTS = ('admin', 'employee', 'profile')
+
+
+class MemoryBackend:
+    """LRU в памяти процесса"""
+
+    def __init__(self, maxsize, ttl):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value):
+        self._cache.set(key, value)
+
+    def delete_many(self, keys):
+        for key in keys:
+            self._cache.delete(key)
+
+    def clear(self):
+        self._cache.clear()
+
+
+class RedisBackend:
+    """Общий кэш для всех процессов и серверов"""
+
+    prefix = 'fragment:'
+
+    def __init__(self, url, ttl):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('Для FRAGMENT_CACHE_URL=redis://... установите пакет redis')
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self._redis.get(self.prefix + key)
+        if value is None:
+            return None
+        signature, html = value.decode('utf-8').split('\n', 1)
+        return signature, html
+
+    def set(self, key, value):
+        signature, html = value
+        self._redis.set(self.prefix + key, f"{signature}\n{html}", ex=self.ttl)
+
+    def delete_many(self, keys):
+        if keys:
+            self._redis.delete(*[self.prefix + key for key in keys])
+
+    def clear(self):
+        keys = list(self._redis.scan_iter(match=self.prefix + '*', count=1000))
+        if keys:
+            self._redis.delete(*keys)
+
+
+class FragmentCache:
+    def __init__(self, app, backend):
+        self.app = app
+        self.backend = backend
+
+    @staticmethod
+    def users_version():
+        """Меняется при изменении или удалении любого пользователя; один запрос на запрос страницы"""
+        if 'fragment_users_version' not in g:
+            latest, count = db.session.query(func.max(User.updated_at), func.count(User.id)).one()
+            g.fragment_users_version = f"{latest.isoformat() if latest else ''}:{count}"
+        return g.fragment_users_version
+
+    def signature(self, task):
+        updated_at = task.updated_at.isoformat() if task.updated_at else ''
+        return f"{updated_at}:{task.file_count}:{task.comment_count}:{self.users_version()}"
+
+    def preload(self, variant, tasks, load):
+        """
+        Проверяет кэш для заданий страницы до рендера и вызывает load(задания)
+        один раз для тех, чьи карточки придется рендерить (догрузить связи).
+        """
+        hits = g.setdefault('fragment_hits', {})
+        missing = []
+        for task in tasks:
+            key = f"{variant}:{task.id}"
+            cached = self.backend.get(key)
+            if cached is not None and cached[0] == self.signature(task):
+                hits[key] = cached[1]
+            else:
+                missing.append(task)
+        if missing:
+            load(missing)
+
+    def render(self, variant, task):
+        """HTML карточки задания: из кэша или свежий рендер"""
+        key = f"{variant}:{task.id}"
+        html = g.get('fragment_hits', {}).pop(key, None)
+        if html is not None:
+            return Markup(html)
+        signature = self.signature(task)
+        cached = self.backend.get(key)
+        if cached is not None and cached[0] == signature:
+            return Markup(cached[1])
+
+        html = self.app.jinja_env.get_template(f'task_card_{variant}.html').render(task=task)
+        self.backend.set(key, (signature, html))
+        return Markup(html)
+
+    def invalidate_task(self, task_id):
+        self.backend.delete_many([f"{variant}:{task_id}" for variant in VARIANTS])
+
+    def clear(self, _=None):
+        self.backend.clear()
+
+
+def init_fragment_cache(app):
+    """Создает кэш карточек, подписывается на изменения моделей и регистрирует task_card() в шаблонах"""
+    url = app.config['FRAGMENT_CACHE_URL']
+    ttl = app.config['FRAGMENT_CACHE_TTL']
+    if url:
+        backend = RedisBackend(url, ttl)
+    else:
+        backend = MemoryBackend(app.config['FRAGMENT_CACHE_SIZE'], ttl)
+
+    fragments = FragmentCache(app, backend)
+    invalidate_on_commit(Task, fragments.invalidate_task)
+    invalidate_on_commit(File, fragments.invalidate_task, key=lambda target: target.task_id)
+    invalidate_on_commit(Comment, fragments.invalidate_task, key=lambda target: target.task_id)
+    invalidate_on_commit(User, fragments.clear)
+
+    app.jinja_env.globals['task_card'] = fragments.render
+    return fragments
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""
+Настройки Gunicorn. Все значения можно переопределить переменными окружения.
+
+Плавная перезагрузка без потери запросов: kill -HUP <pid мастера>.
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND') or f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Процессы x потоки: потоки освобождаются на время ввода-вывода (файлы, SQLite)
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Приложение импортируется один раз в мастере, воркеры стартуют быстро
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# Большие загрузки и скачивания могут идти долго
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Периодический перезапуск воркеров от утечек памяти
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    # Соединения с базой не должны переходить из мастера в воркеры
+    from app import app
+    from models import db
+
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Хеширование паролей с настраиваемыми параметрами.
+
+Схема задается Config.PASSWORD_HASH_METHOD в формате Werkzeug
+(scrypt:N:r:p или pbkdf2:sha256:итерации). Вычисления выполняются в
+ограниченном пуле потоков: при наплыве входов одновременно считается не
+больше PASSWORD_HASH_WORKERS хешей, ждут не больше PASSWORD_HASH_QUEUE, и
+все вместе занимают меньше потоков воркера, чем REQUEST_THREADS. Лишние
+запросы сразу получают отказ вместо того, чтобы занимать все потоки.
+
+Замер скорости вариантов параметров:
+  python hashing.py benchmark [метод ...]
+"""
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_BENCHMARK_METHODS = [
+    'scrypt:16384:8:1',
+    'scrypt:32768:8:1',
+    'scrypt:65536:8:1',
+    'pbkdf2:sha256:260000',
+    'pbkdf2:sha256:600000',
+]
+
+_executor = None
+_slots = None
+_lock = threading.Lock()
+
+
+class HashingBusy(Exception):
+    """Очередь на хеширование переполнена"""
+
+
+def hash_slots(config):
+    """
+    Сколько запросов одновременно могут хешировать или ждать очереди. Каждый из
+    них держит поток запроса, и хотя бы один поток воркера остается для
+    остальных маршрутов.
+    """
+    slots = config['PASSWORD_HASH_WORKERS'] + config['PASSWORD_HASH_QUEUE']
+    return max(min(slots, config['REQUEST_THREADS'] - 1), 1)
+
+
+def _submit(func, *args):
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            slots = hash_slots(current_app.config)
+            workers = min(current_app.config['PASSWORD_HASH_WORKERS'], slots)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+            _slots = threading.BoundedSemaphore(slots)
+
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        future = _executor.submit(func, *args)
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future.result()
+
+
+def hash_password(password):
+    return _submit(generate_password_hash, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def verify_password(password_hash, password):
+    return _submit(check_password_hash, password_hash, password)
+
+
+@lru_cache(maxsize=8)
+def _method_prefix(method):
+    """Полная запись метода так, как Werkzeug сохраняет ее в хеше ('scrypt' -> 'scrypt:32768:8:1')"""
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+def needs_rehash(password_hash):
+    """Хеш создан с параметрами, отличными от текущих настроек"""
+    return password_hash.split('$', 1)[0] != _method_prefix(current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def benchmark(methods, seconds=1.0):
+    """Хешей в секунду на одно ядро для каждого метода"""
+    results = []
+    for method in methods:
+        count = 0
+        started = time.perf_counter()
+        while True:
+            generate_password_hash('benchmark-password', method)
+            count += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= seconds:
+                break
+        results.append((method, count / elapsed, elapsed / count * 1000))
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'benchmark':
+        print("Использование:")
+        print("  python hashing.py benchmark [метод ...]  - скорость хеширования на одно ядро")
+        sys.exit(1)
+
+    methods = sys.argv[2:] or DEFAULT_BENCHMARK_METHODS
+    cores = os.cpu_count() or 1
+    print(f"Ядер: {cores}")
+    print(f"{'Метод':<28}{'хешей/с на ядро':>18}{'мс на хеш':>12}{'входов/с всего':>18}")
+    for method, rate, ms in benchmark(methods):
+        print(f"{method:<28}{rate:>18.1f}{ms:>12.1f}{rate * cores:>18.1f}")
@@ -9,12 +9,13 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from app import app
 from models import db, User, init_db
+from migrations import migrate
 
 def init_database():
     """Инициализация базы данных"""
     with app.app_context():
         print("Создание таблиц базы данных...")
-        db.create_all()
+        migrate()
         
         print("Создание админ пользователя...")
         admin = User.query.filter_by(username='Tural Jafarov').first()
@@ -35,4 +36,9 @@ def init_database():
         print("✅ База данных инициализирована успешно!")
 
 if __name__ == '__main__':
+    # Шаг release платформы (Procfile): файловая система контейнера временная,
+    # база SQLite по умолчанию пропала бы вместе с ним
+    if '--release' in sys.argv[1:] and not os.environ.get('DATABASE_URL'):
+        print("❌ Не задан DATABASE_URL: для развертывания нужна постоянная база (например, PostgreSQL)")
+        sys.exit(1)
     init_database()
\ No newline at end of file
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Версионные миграции схемы базы данных.
+
+db.create_all() создает только отсутствующие таблицы и не трогает уже
+существующие, поэтому новые индексы и колонки в рабочих task_manager.db
+добавляются миграциями. Текущая версия схемы хранится в таблице
+schema_version; при запуске применяются только миграции с большим номером.
+
+  python migrations.py          - применить новые миграции
+  python migrations.py recount  - пересчитать счетчики файлов и комментариев заданий
+"""
+
+import os
+import sys
+
+# Добавляем текущую папку в Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import inspect, text
+
+from models import db, Task, File, Comment, recount_task_counters
+
+
+def _create_indexes(conn, *models):
+    for model in models:
+        for index in model.__table__.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def _add_column(conn, table, column, definition):
+    columns = {c['name'] for c in inspect(conn).get_columns(table)}
+    if column not in columns:
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {definition}'))
+
+
+def add_lookup_indexes(conn):
+    _create_indexes(conn, Task, File, Comment)
+
+
+def add_file_checksum(conn):
+    _add_column(conn, 'files', 'checksum', 'VARCHAR(64)')
+
+
+def add_file_blob(conn):
+    _add_column(conn, 'files', 'blob_id', 'INTEGER REFERENCES blobs (id)')
+
+
+def add_file_previews(conn):
+    _add_column(conn, 'files', 'thumbnail_path', 'VARCHAR(500)')
+    _add_column(conn, 'files', 'preview_path', 'VARCHAR(500)')
+
+
+def add_task_counters(conn):
+    _add_column(conn, 'tasks', 'file_count', 'INTEGER NOT NULL DEFAULT 0')
+    _add_column(conn, 'tasks', 'comment_count', 'INTEGER NOT NULL DEFAULT 0')
+    conn.execute(text(
+        'UPDATE tasks SET '
+        'file_count = (SELECT COUNT(*) FROM files WHERE files.task_id = tasks.id), '
+        'comment_count = (SELECT COUNT(*) FROM comments WHERE comments.task_id = tasks.id)'
+    ))
+
+
+# (номер, описание, функция миграции) - номера только растут
+MIGRATIONS = [
+    (1, 'Индексы для выборок заданий, файлов и комментариев', add_lookup_indexes),
+    (2, 'Контрольная сумма SHA-256 для файлов', add_file_checksum),
+    (3, 'Ссылка файлов на общее хранилище содержимого', add_file_blob),
+    (4, 'Пути к миниатюрам и превью изображений', add_file_previews),
+    (5, 'Счетчики файлов и комментариев у заданий', add_task_counters),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    conn.execute(text('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)'))
+    version = conn.execute(text('SELECT MAX(version) FROM schema_version')).scalar()
+    return version or 0
+
+
+def set_version(conn, version):
+    conn.execute(text('DELETE FROM schema_version'))
+    conn.execute(text('INSERT INTO schema_version (version) VALUES (:version)'), {'version': version})
+
+
+def migrate():
+    """Создает недостающие таблицы и применяет новые миграции"""
+    fresh = not inspect(db.engine).has_table('tasks')
+    db.create_all()
+
+    with db.engine.begin() as conn:
+        version = get_version(conn)
+
+        # Новая база создана сразу по актуальным моделям
+        if fresh:
+            set_version(conn, LATEST_VERSION)
+            return LATEST_VERSION
+
+        for number, description, upgrade in MIGRATIONS:
+            if number <= version:
+                continue
+            print(f"Миграция {number}: {description}")
+            upgrade(conn)
+            set_version(conn, number)
+            version = number
+
+    return version
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        if len(sys.argv) > 1 and sys.argv[1] == 'recount':
+            fixed = recount_task_counters()
+            print(f"✅ Исправлены счетчики у заданий: {fixed}")
+        else:
+            version = migrate()
+            print(f"✅ Версия схемы базы данных: {version}")
@@ -1,11 +1,23 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event
 from datetime import datetime
 import os
 
 db = SQLAlchemy()
 
+def setup_sqlite_pragmas(engine, pragmas):
+    """Применяет PRAGMA к каждому новому соединению SQLite"""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+    
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     
@@ -25,16 +37,30 @@ class User(UserMixin, db.Model):
     comments = db.relationship('Comment', backref='author', lazy=True)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        from hashing import hash_password
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        from hashing import verify_password
+        return verify_password(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        """Пароль захеширован с устаревшими параметрами"""
+        from hashing import needs_rehash
+        return needs_rehash(self.password_hash)
     
     def __repr__(self):
         return f'<User {self.username}>'
 
 class Task(db.Model):
     __tablename__ = 'tasks'
+    __table_args__ = (
+        # Личные задания работника и общие задания, от новых к старым
+        db.Index('ix_tasks_assigned_type_created', 'assigned_to', 'task_type', 'created_at', 'id'),
+        db.Index('ix_tasks_type_created', 'task_type', 'created_at', 'id'),
+        # Список всех заданий в админ панели
+        db.Index('ix_tasks_created', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -45,18 +71,25 @@ class Task(db.Model):
     is_paid = db.Column(db.Boolean, default=False)  # Отметка об оплате
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Счетчики связанных записей, поддерживаются событиями File и Comment (см. ниже)
+    file_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Связи
     assigned_to = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # None для общих заданий
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     files = db.relationship('File', backref='task', lazy=True, cascade='all, delete-orphan')
     comments = db.relationship('Comment', backref='task', lazy=True, cascade='all, delete-orphan')
+    uploads = db.relationship('Upload', backref='task', lazy=True, cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<Task {self.title}>'
 
 class File(db.Model):
     __tablename__ = 'files'
+    __table_args__ = (
+        db.Index('ix_files_task_uploaded', 'task_id', 'uploaded_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
@@ -64,17 +97,62 @@ class File(db.Model):
     file_path = db.Column(db.String(500), nullable=False)
     file_size = db.Column(db.Integer, nullable=False)
     mime_type = db.Column(db.String(100))
+    checksum = db.Column(db.String(64))  # SHA-256 содержимого
+    thumbnail_path = db.Column(db.String(500))  # WebP миниатюра (только для изображений)
+    preview_path = db.Column(db.String(500))  # WebP превью среднего размера
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Связи
     task_id = db.Column(db.Integer, db.ForeignKey('tasks.id'), nullable=False)
     uploaded_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blobs.id'), nullable=True)  # None для файлов до дедупликации
     
     def __repr__(self):
         return f'<File {self.filename}>'
 
+class Blob(db.Model):
+    """Одна физическая копия содержимого, на которую ссылаются записи File"""
+    __tablename__ = 'blobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    digest = db.Column(db.String(64), unique=True, nullable=False)  # SHA-256 содержимого
+    file_path = db.Column(db.String(500), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Связи
+    files = db.relationship('File', backref='blob', lazy=True)
+    
+    def __repr__(self):
+        return f'<Blob {self.digest} x{self.ref_count}>'
+
+class Upload(db.Model):
+    """Незавершенная загрузка файла частями"""
+    __tablename__ = 'uploads'
+    
+    id = db.Column(db.String(32), primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)
+    original_filename = db.Column(db.String(255), nullable=False)
+    file_path = db.Column(db.String(500), nullable=False)
+    length = db.Column(db.BigInteger, nullable=False)  # Заявленный размер файла
+    offset = db.Column(db.BigInteger, nullable=False, default=0)  # Сколько байт уже принято
+    mime_type = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Связи
+    task_id = db.Column(db.Integer, db.ForeignKey('tasks.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    
+    def __repr__(self):
+        return f'<Upload {self.id} {self.offset}/{self.length}>'
+
 class Comment(db.Model):
     __tablename__ = 'comments'
+    __table_args__ = (
+        db.Index('ix_comments_task_created', 'task_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
@@ -87,9 +165,48 @@ class Comment(db.Model):
     def __repr__(self):
         return f'<Comment {self.id}>'
 
+def _track_count(model, column):
+    """Изменяет счетчик задания при добавлении и удалении записей model в той же транзакции"""
+    counter = getattr(Task, column)
+    
+    def change(connection, task_id, delta):
+        # updated_at указан явно, иначе сработал бы onupdate и задание считалось бы измененным
+        connection.execute(
+            db.update(Task).where(Task.id == task_id)
+            .values({column: counter + delta, 'updated_at': Task.updated_at})
+        )
+    
+    @event.listens_for(model, 'after_insert')
+    def increment(mapper, connection, target):
+        change(connection, target.task_id, 1)
+    
+    @event.listens_for(model, 'after_delete')
+    def decrement(mapper, connection, target):
+        change(connection, target.task_id, -1)
+
+_track_count(File, 'file_count')
+_track_count(Comment, 'comment_count')
+
+def recount_task_counters():
+    """Пересчитывает file_count и comment_count всех заданий по таблицам files и comments"""
+    files = (db.select(db.func.count(File.id))
+             .where(File.task_id == Task.id).scalar_subquery())
+    comments = (db.select(db.func.count(Comment.id))
+                .where(Comment.task_id == Task.id).scalar_subquery())
+    result = db.session.execute(
+        db.update(Task)
+        .where((Task.file_count != files) | (Task.comment_count != comments))
+        .values(file_count=files, comment_count=comments, updated_at=Task.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
 def init_db():
     """Инициализация базы данных и создание админ пользователя"""
-    db.create_all()
+    from migrations import migrate
+    
+    migrate()
     
     # Создание админ пользователя, если он не существует
     admin = User.query.filter_by(username='Tural Jafarov').first()
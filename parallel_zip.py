@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Сборка ZIP архива с параллельным сжатием файлов.
+
+zipfile сжимает файлы по очереди на одном ядре. Здесь каждый файл сжимается
+(raw deflate) в отдельном процессе во временный файл, параллельно считаются
+CRC-32 и SHA-256. Главный процесс за один проход дописывает готовые данные
+в архив и в конце записывает центральный каталог. Уже сжатые файлы не
+отправляются в пул: они копируются в архив как есть (ZIP_STORED).
+
+Большие файлы и архивы (больше 2 ГБ, больше 65535 файлов) записываются
+с расширениями ZIP64, архив читается обычным zipfile и unzip.
+"""
+
+import datetime
+import hashlib
+import os
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+BLOCK_SIZE = 1024 * 1024
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+# Как в zipfile: начиная с этого размера или смещения нужны поля ZIP64
+ZIP64_LIMIT = (1 << 31) - 1
+UTF8_FLAG = 0x800
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+END_RECORD = struct.Struct('<IHHHHIIH')
+ZIP64_END_RECORD = struct.Struct('<IQHHIIQQQQ')
+ZIP64_LOCATOR = struct.Struct('<IIQI')
+
+
+def dos_datetime(mtime):
+    """Дата и время в формате MS-DOS (как в заголовках ZIP)"""
+    value = datetime.datetime.fromtimestamp(mtime)
+    if value.year < 1980:
+        value = datetime.datetime(1980, 1, 1)
+    dos_time = (value.hour << 11) | (value.minute << 5) | (value.second // 2)
+    dos_date = ((value.year - 1980) << 9) | (value.month << 5) | value.day
+    return dos_time, dos_date
+
+
+class ZipAssembler:
+    """Пишет ZIP архив из готовых (уже сжатых) данных"""
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.entries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+
+    def _write_header(self, name, method, mtime, crc, size, compressed_size, zip64):
+        dos_time, dos_date = dos_datetime(mtime)
+        offset = self.file.tell()
+        extra = struct.pack('<HHQQ', 1, 16, size, compressed_size) if zip64 else b''
+        self.file.write(LOCAL_HEADER.pack(
+            0x04034b50, 45 if zip64 else 20, UTF8_FLAG, method, dos_time, dos_date, crc,
+            0xFFFFFFFF if zip64 else compressed_size, 0xFFFFFFFF if zip64 else size,
+            len(name), len(extra),
+        ))
+        self.file.write(name)
+        self.file.write(extra)
+        return offset
+
+    def _add_entry(self, name, method, mtime, crc, size, compressed_size, offset):
+        self.entries.append((name, method, mtime, crc, size, compressed_size, offset))
+
+    def add_compressed(self, arcname, method, mtime, crc, size, compressed_size, data_path):
+        """Добавляет файл, данные которого уже сжаты в data_path"""
+        name = arcname.encode('utf-8')
+        zip64 = size > ZIP64_LIMIT or compressed_size > ZIP64_LIMIT
+        offset = self._write_header(name, method, mtime, crc, size, compressed_size, zip64)
+        with open(data_path, 'rb') as src:
+            for block in iter(lambda: src.read(BLOCK_SIZE), b''):
+                self.file.write(block)
+        self._add_entry(name, method, mtime, crc, size, compressed_size, offset)
+
+    def add_file(self, arcname, file_path, mtime):
+        """Копирует файл без сжатия за одно чтение и возвращает его SHA-256"""
+        name = arcname.encode('utf-8')
+        expected = os.path.getsize(file_path)
+        zip64 = expected > ZIP64_LIMIT
+        offset = self._write_header(name, ZIP_STORED, mtime, 0, expected, expected, zip64)
+
+        crc = 0
+        size = 0
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as src:
+            for block in iter(lambda: src.read(BLOCK_SIZE), b''):
+                crc = zlib.crc32(block, crc)
+                hasher.update(block)
+                size += len(block)
+                self.file.write(block)
+        if size > ZIP64_LIMIT and not zip64:
+            raise ValueError(f'{file_path} вырос во время копирования')
+
+        # CRC и точный размер известны только после чтения - дописываем их в заголовок
+        end = self.file.tell()
+        self.file.seek(offset)
+        self._write_header(name, ZIP_STORED, mtime, crc, size, size, zip64)
+        self.file.seek(end)
+        self._add_entry(name, ZIP_STORED, mtime, crc, size, size, offset)
+        return hasher.hexdigest()
+
+    def writestr(self, arcname, data, mtime=None):
+        """Добавляет небольшие данные из памяти со сжатием"""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        name = arcname.encode('utf-8')
+        mtime = datetime.datetime.now().timestamp() if mtime is None else mtime
+        crc = zlib.crc32(data)
+        zip64 = len(data) > ZIP64_LIMIT or len(compressed) > ZIP64_LIMIT
+        offset = self._write_header(name, ZIP_DEFLATED, mtime, crc, len(data), len(compressed), zip64)
+        self.file.write(compressed)
+        self._add_entry(name, ZIP_DEFLATED, mtime, crc, len(data), len(compressed), offset)
+
+    def close(self):
+        """Записывает центральный каталог"""
+        start = self.file.tell()
+        for name, method, mtime, crc, size, compressed_size, offset in self.entries:
+            dos_time, dos_date = dos_datetime(mtime)
+            zip64 = size > ZIP64_LIMIT or compressed_size > ZIP64_LIMIT or offset > ZIP64_LIMIT
+            extra = struct.pack('<HHQQQ', 1, 24, size, compressed_size, offset) if zip64 else b''
+            self.file.write(CENTRAL_HEADER.pack(
+                0x02014b50, (3 << 8) | 45, 45 if zip64 else 20, UTF8_FLAG, method, dos_time, dos_date, crc,
+                0xFFFFFFFF if zip64 else compressed_size, 0xFFFFFFFF if zip64 else size,
+                len(name), len(extra), 0, 0, 0, 0o644 << 16,
+                0xFFFFFFFF if zip64 else offset,
+            ))
+            self.file.write(name)
+            self.file.write(extra)
+
+        end = self.file.tell()
+        count = len(self.entries)
+        size = end - start
+        if count >= 0xFFFF or start > ZIP64_LIMIT or size > ZIP64_LIMIT:
+            self.file.write(ZIP64_END_RECORD.pack(0x06064b50, 44, 45, 45, 0, 0, count, count, size, start))
+            self.file.write(ZIP64_LOCATOR.pack(0x07064b50, 0, end, 1))
+            self.file.write(END_RECORD.pack(0x06054b50, 0, 0, 0xFFFF, 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF, 0))
+        else:
+            self.file.write(END_RECORD.pack(0x06054b50, 0, 0, count, count, size, start, 0))
+        self.file.close()
+
+
+def compress_file(file_path, spool_path, level):
+    """
+    Сжимает файл в spool_path (raw deflate, как внутри ZIP).
+    Выполняется в процессе пула; возвращает размеры, CRC-32 и SHA-256.
+    """
+    crc = 0
+    size = 0
+    hasher = hashlib.sha256()
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    with open(file_path, 'rb') as src, open(spool_path, 'wb') as dst:
+        for block in iter(lambda: src.read(BLOCK_SIZE), b''):
+            crc = zlib.crc32(block, crc)
+            hasher.update(block)
+            size += len(block)
+            dst.write(compressor.compress(block))
+        dst.write(compressor.flush())
+    return {
+        'crc': crc,
+        'size': size,
+        'compressed_size': os.path.getsize(spool_path),
+        'sha256': hasher.hexdigest(),
+    }
+
+
+def write_members(archive, members, spool_dir, workers=1, level=6, store=lambda path: False):
+    """
+    Добавляет файлы в архив, сжимая их в workers процессах.
+
+    members - список (имя в архиве, путь, mtime в секундах), store(path) -
+    сохранить файл без сжатия. Возвращает {имя в архиве: SHA-256}.
+    """
+    hashes = {}
+    stored = []
+    deflated = []
+    for member in members:
+        (stored if store(member[1]) else deflated).append(member)
+
+    def spool_path(number):
+        return os.path.join(spool_dir, f'{number}.deflate')
+
+    def add_result(member, spool, result):
+        arcname, file_path, mtime = member
+        archive.add_compressed(arcname, ZIP_DEFLATED, mtime, result['crc'], result['size'],
+                               result['compressed_size'], spool)
+        os.remove(spool)
+        hashes[arcname] = result['sha256']
+
+    if workers <= 1:
+        for number, member in enumerate(deflated):
+            add_result(member, spool_path(number), compress_file(member[1], spool_path(number), level))
+        for arcname, file_path, mtime in stored:
+            hashes[arcname] = archive.add_file(arcname, file_path, mtime)
+        return hashes
+
+    # Во временной папке не больше window сжатых, но еще не записанных файлов
+    window = workers * 4
+    queue = iter(enumerate(deflated))
+    stored_queue = iter(stored)
+    pending = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            while len(pending) < window:
+                item = next(queue, None)
+                if item is None:
+                    break
+                number, member = item
+                future = pool.submit(compress_file, member[1], spool_path(number), level)
+                pending[future] = (member, spool_path(number))
+
+            for future in [future for future in pending if future.done()]:
+                member, spool = pending.pop(future)
+                add_result(member, spool, future.result())
+
+            # Пока пул сжимает, главный процесс копирует несжимаемые файлы
+            member = next(stored_queue, None)
+            if member is not None:
+                arcname, file_path, mtime = member
+                hashes[arcname] = archive.add_file(arcname, file_path, mtime)
+                continue
+            if not pending:
+                break
+            wait(pending, return_when=FIRST_COMPLETED)
+    return hashes
@@ -0,0 +1,87 @@
+"""
+Массовая отметка оплаты заданий.
+
+Неоплаченные задания с суммой оплаты по работнику и периоду создания
+отмечаются оплаченными одним UPDATE ... RETURNING. Условие "не оплачено"
+проверяется в самом UPDATE, поэтому параллельная отметка не заплатит за
+задание дважды, а сводка (сколько заданий и на какую сумму, в том числе по
+каждому работнику) строится только по реально измененным строкам.
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, select, update
+
+from models import db, Task
+
+
+class SettlementError(Exception):
+    """Некорректные параметры отметки оплаты"""
+
+
+def parse_date(value, name):
+    if value in (None, ''):
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        raise SettlementError(f'{name} - дата в формате ГГГГ-ММ-ДД')
+
+
+def unpaid_conditions(employee_id=None, date_from=None, date_to=None):
+    """Условия WHERE для неоплаченных заданий с суммой оплаты; date_to включительно"""
+    conditions = [
+        or_(Task.is_paid == False, Task.is_paid.is_(None)),
+        Task.payment_amount.isnot(None),
+    ]
+    if employee_id is not None:
+        conditions.append(Task.assigned_to == employee_id)
+    if date_from is not None:
+        conditions.append(Task.created_at >= date_from)
+    if date_to is not None:
+        conditions.append(Task.created_at < date_to + timedelta(days=1))
+    return conditions
+
+
+def summarize(rows):
+    """Количество и сумма заданий, всего и по работникам (employee_id None - общие задания)"""
+    employees = {}
+    for _, assigned_to, amount in rows:
+        totals = employees.setdefault(assigned_to, {'employee_id': assigned_to, 'tasks': 0, 'amount': 0})
+        totals['tasks'] += 1
+        totals['amount'] += float(amount)
+    for totals in employees.values():
+        totals['amount'] = round(totals['amount'], 2)
+    return {
+        'tasks': len(rows),
+        'amount': round(sum(float(amount) for _, _, amount in rows), 2),
+        'employees': list(employees.values()),
+    }
+
+
+def settle_payments(employee_id=None, date_from=None, date_to=None, dry_run=False):
+    """
+    Отмечает оплаченными подходящие задания одной транзакцией и возвращает сводку.
+    dry_run - только посчитать, ничего не меняя.
+    """
+    if date_from and date_to and date_from > date_to:
+        raise SettlementError('Начало периода позже конца')
+
+    conditions = unpaid_conditions(employee_id, date_from, date_to)
+    columns = (Task.id, Task.assigned_to, Task.payment_amount)
+    if dry_run:
+        rows = db.session.execute(select(*columns).where(*conditions)).all()
+        db.session.rollback()
+        return summarize(rows)
+
+    # updated_at меняется, чтобы карточки заданий в кэше считались устаревшими
+    rows = db.session.execute(
+        update(Task)
+        .where(*conditions)
+        .values(is_paid=True, updated_at=datetime.utcnow())
+        .returning(*columns)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.session.commit()
+    # Порядок строк RETURNING не гарантирован, а SQLite возвращает целые суммы как int
+    return summarize(sorted(rows))
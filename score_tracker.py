@@ -2,6 +2,7 @@
 
 import sys
 import sqlite3
+from contextlib import contextmanager
 from datetime import datetime
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                            QHBoxLayout, QPushButton, QLineEdit, QLabel,
@@ -12,65 +13,86 @@ from PyQt5.QtCore import Qt
 
 
 class ScoreTrackerDB:
+    # Подготовленных запросов в кэше соединения
+    CACHED_STATEMENTS = 64
+
     def __init__(self, db_name="score_tracker.db"):
         self.db_name = db_name
+        # Одно соединение на все время работы; транзакции открываются явно в transaction()
+        self.conn = sqlite3.connect(db_name, isolation_level=None,
+                                    cached_statements=self.CACHED_STATEMENTS)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
         self.init_database()
     
+    @contextmanager
+    def transaction(self):
+        # Вложенный вызов выполняется в уже открытой транзакции
+        if self.conn.in_transaction:
+            yield self.conn
+            return
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+    
+    def close(self):
+        self.conn.close()
+    
     def init_database(self):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                score INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS posts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                title TEXT NOT NULL,
-                content TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS deleted_users (
-                id INTEGER PRIMARY KEY,
-                username TEXT NOT NULL,
-                score INTEGER DEFAULT 0,
-                deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                original_created_at TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    score INTEGER DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS posts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    title TEXT NOT NULL,
+                    content TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+                )
+            ''')
+            
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS deleted_users (
+                    id INTEGER PRIMARY KEY,
+                    username TEXT NOT NULL,
+                    score INTEGER DEFAULT 0,
+                    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    original_created_at TIMESTAMP
+                )
+            ''')
     
     def add_user(self, username, score=0):
         try:
-            conn = sqlite3.connect(self.db_name)
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO users (username, score) VALUES (?, ?)",
-                (username, score)
-            )
-            conn.commit()
-            conn.close()
+            with self.transaction() as conn:
+                conn.execute(
+                    "INSERT INTO users (username, score) VALUES (?, ?)",
+                    (username, score)
+                )
             return True
         except sqlite3.IntegrityError:
             return False
     
+    def get_user_id(self, username):
+        result = self.conn.execute(
+            "SELECT id FROM users WHERE username = ?", (username,)
+        ).fetchone()
+        return result[0] if result else None
+    
     def get_all_users(self):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute('''
+        return self.conn.execute('''
             SELECT u.id, u.username, u.score, 
                    COUNT(p.id) as posts_count,
                    GROUP_CONCAT(p.title, '; ') as post_titles
@@ -78,166 +100,101 @@ class ScoreTrackerDB:
             LEFT JOIN posts p ON u.id = p.user_id
             GROUP BY u.id, u.username, u.score
             ORDER BY u.score DESC
-        ''')
-        users = cursor.fetchall()
-        conn.close()
-        return users
+        ''').fetchall()
     
     def update_user_score(self, user_id, new_score):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE users SET score = ? WHERE id = ?",
-            (new_score, user_id)
-        )
-        conn.commit()
-        affected = cursor.rowcount
-        conn.close()
-        return affected > 0
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE users SET score = ? WHERE id = ?",
+                (new_score, user_id)
+            )
+        return cursor.rowcount > 0
     
     def add_post(self, user_id, title, content=""):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO posts (user_id, title, content) VALUES (?, ?, ?)",
-            (user_id, title, content)
-        )
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO posts (user_id, title, content) VALUES (?, ?, ?)",
+                (user_id, title, content)
+            )
     
     def get_user_posts(self, user_id):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute(
+        return self.conn.execute(
             "SELECT id, title, content, created_at FROM posts WHERE user_id = ? ORDER BY created_at DESC",
             (user_id,)
-        )
-        posts = cursor.fetchall()
-        conn.close()
-        return posts
+        ).fetchall()
     
     def delete_user(self, user_id):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-        conn.commit()
-        affected = cursor.rowcount
-        conn.close()
-        return affected > 0
+        with self.transaction() as conn:
+            cursor = conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        return cursor.rowcount > 0
     
     def delete_post(self, post_id):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM posts WHERE id = ?", (post_id,))
-        conn.commit()
-        affected = cursor.rowcount
-        conn.close()
-        return affected > 0
+        with self.transaction() as conn:
+            cursor = conn.execute("DELETE FROM posts WHERE id = ?", (post_id,))
+        return cursor.rowcount > 0
     
     def update_post(self, post_id, title, content):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE posts SET title = ?, content = ? WHERE id = ?",
-            (title, content, post_id)
-        )
-        conn.commit()
-        affected = cursor.rowcount
-        conn.close()
-        return affected > 0
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE posts SET title = ?, content = ? WHERE id = ?",
+                (title, content, post_id)
+            )
+        return cursor.rowcount > 0
     
     def move_user_to_deleted(self, user_id):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "SELECT username, score, created_at FROM users WHERE id = ?",
-            (user_id,)
-        )
-        user_data = cursor.fetchone()
-        
-        if not user_data:
-            conn.close()
-            return False
-        
-        username, score, created_at = user_data
-        
-        cursor.execute(
-            "INSERT INTO deleted_users (id, username, score, original_created_at) VALUES (?, ?, ?, ?)",
-            (user_id, username, score, created_at)
-        )
-        
-        cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-        
-        conn.commit()
-        affected = cursor.rowcount
-        conn.close()
-        return affected > 0
+        with self.transaction() as conn:
+            user_data = conn.execute(
+                "SELECT username, score, created_at FROM users WHERE id = ?",
+                (user_id,)
+            ).fetchone()
+            
+            if not user_data:
+                return False
+            
+            username, score, created_at = user_data
+            
+            conn.execute(
+                "INSERT INTO deleted_users (id, username, score, original_created_at) VALUES (?, ?, ?, ?)",
+                (user_id, username, score, created_at)
+            )
+            
+            cursor = conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        return cursor.rowcount > 0
     
     def get_deleted_users(self):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute('''
+        return self.conn.execute('''
             SELECT id, username, score, deleted_at, original_created_at
             FROM deleted_users
             ORDER BY deleted_at DESC
-        ''')
-        users = cursor.fetchall()
-        conn.close()
-        return users
+        ''').fetchall()
     
     def restore_user(self, user_id):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT username FROM deleted_users WHERE id = ?", (user_id,))
-        deleted_user = cursor.fetchone()
-        
-        if not deleted_user:
-            conn.close()
-            return False
-        
-        username = deleted_user[0]
-        
-        cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
-        existing = cursor.fetchone()
-        
-        if existing:
-            conn.close()
-            return False
-        
-        cursor.execute(
-            "SELECT score, original_created_at FROM deleted_users WHERE id = ?",
-            (user_id,)
-        )
-        user_data = cursor.fetchone()
-        
-        if not user_data:
-            conn.close()
-            return False
-        
-        score, original_created_at = user_data
-        
-        cursor.execute(
-            "INSERT INTO users (id, username, score, created_at) VALUES (?, ?, ?, ?)",
-            (user_id, username, score, original_created_at)
-        )
-        
-        cursor.execute("DELETE FROM deleted_users WHERE id = ?", (user_id,))
-        
-        conn.commit()
-        affected = cursor.rowcount
-        conn.close()
-        return affected > 0
+        with self.transaction() as conn:
+            user_data = conn.execute(
+                "SELECT username, score, original_created_at FROM deleted_users WHERE id = ?",
+                (user_id,)
+            ).fetchone()
+            
+            if not user_data:
+                return False
+            
+            username, score, original_created_at = user_data
+            
+            if self.get_user_id(username) is not None:
+                return False
+            
+            conn.execute(
+                "INSERT INTO users (id, username, score, created_at) VALUES (?, ?, ?, ?)",
+                (user_id, username, score, original_created_at)
+            )
+            
+            cursor = conn.execute("DELETE FROM deleted_users WHERE id = ?", (user_id,))
+        return cursor.rowcount > 0
     
     def permanently_delete_user(self, user_id):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM deleted_users WHERE id = ?", (user_id,))
-        conn.commit()
-        affected = cursor.rowcount
-        conn.close()
-        return affected > 0
+        with self.transaction() as conn:
+            cursor = conn.execute("DELETE FROM deleted_users WHERE id = ?", (user_id,))
+        return cursor.rowcount > 0
 
 
 class ScoreDescriptionDialog(QDialog):
@@ -433,6 +390,10 @@ class ScoreTrackerApp(QMainWindow):
         self.init_ui()
         self.refresh_users_table()
     
+    def closeEvent(self, event):
+        self.db.close()
+        super().closeEvent(event)
+    
     def init_ui(self):
         self.setWindowTitle("Мини Трекер Очков")
         self.setGeometry(100, 100, 800, 600)
@@ -588,17 +549,11 @@ class ScoreTrackerApp(QMainWindow):
             QMessageBox.warning(self, "Ошибка", "Введите имя пользователя для добавления поста!")
             return
         
-        conn = sqlite3.connect(self.db.db_name)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
-        result = cursor.fetchone()
-        conn.close()
-        
-        if not result:
+        user_id = self.db.get_user_id(username)
+        if user_id is None:
             QMessageBox.warning(self, "Ошибка", "Пользователь не найден!")
             return
         
-        user_id = result[0]
         title = f"Пост от {username}"
         content = f"Содержание поста для {username}"
         
@@ -697,26 +652,23 @@ class ScoreTrackerApp(QMainWindow):
         if dialog.exec_() == QDialog.Accepted:
             data = dialog.get_description_data()
             
-            if self.db.add_user(username, score):
-                conn = sqlite3.connect(self.db.db_name)
-                cursor = conn.cursor()
-                cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
-                result = cursor.fetchone()
-                conn.close()
-                
-                if result:
-                    user_id = result[0]
-                    title = f"Добавление баллов: {data['reason'][:30]}..."
-                    content = f"""Дата: {data['date']}
+            title = f"Добавление баллов: {data['reason'][:30]}..."
+            content = f"""Дата: {data['date']}
 За что: {data['reason']}
 Кто добавил: {data['added_by']}
 Количество: {data['score']} баллов"""
-                    
+            
+            # Пользователь и пост с описанием добавляются вместе или не добавляются
+            with self.db.transaction():
+                user_id = self.db.get_user_id(username) if self.db.add_user(username, score) else None
+                if user_id is not None:
                     self.db.add_post(user_id, title, content)
-                    QMessageBox.information(self, "Успех", "Пользователь и описание добавлены!")
-                    self.username_input.clear()
-                    self.score_input.setText("0")
-                    self.refresh_users_table()
+            
+            if user_id is not None:
+                QMessageBox.information(self, "Успех", "Пользователь и описание добавлены!")
+                self.username_input.clear()
+                self.score_input.setText("0")
+                self.refresh_users_table()
             else:
                 QMessageBox.warning(self, "Ошибка", "Пользователь с таким именем уже существует!")
     
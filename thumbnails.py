@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Фоновая генерация миниатюр и превью для загруженных изображений.
+
+После сохранения файла задача ставится в пул потоков, чтобы запрос
+загрузки не ждал обработки картинки. Рядом с оригиналом сохраняются
+<файл>.thumb.webp и <файл>.preview.webp, пути записываются в File.
+
+Создать превью для уже загруженных изображений:
+  python thumbnails.py
+"""
+
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Добавляем текущую папку в Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from models import db, File
+
+# Имя варианта -> максимальные размеры (ширина, высота)
+PREVIEW_SIZES = {
+    'thumb': (320, 320),
+    'preview': (1280, 1280),
+}
+WEBP_QUALITY = 80
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def variant_path(file_path, variant):
+    return f"{file_path}.{variant}.webp"
+
+
+def variant_paths(file_path):
+    """Пути всех вариантов превью для файла"""
+    return [variant_path(file_path, variant) for variant in PREVIEW_SIZES]
+
+
+def is_image(file_record):
+    return (file_record.mime_type or '').startswith('image/') and file_record.mime_type != 'image/svg+xml'
+
+
+def render_variants(file_path):
+    """Сохраняет WebP варианты изображения, возвращает {вариант: путь} или None"""
+    try:
+        with Image.open(file_path) as image:
+            # JPEG можно декодировать сразу в уменьшенном размере
+            image.draft('RGB', max(PREVIEW_SIZES.values()))
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+            paths = {}
+            for variant, size in sorted(PREVIEW_SIZES.items(), key=lambda item: -item[1][0]):
+                path = variant_path(file_path, variant)
+                if not os.path.exists(path):
+                    image.thumbnail(size)
+                    image.save(path, 'WEBP', quality=WEBP_QUALITY, method=4)
+                paths[variant] = path
+            return paths
+    except (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"Не удалось создать превью для {file_path}: {e}")
+        return None
+
+
+def generate_previews(file_id):
+    """Создает превью для записи File и сохраняет пути к ним"""
+    file_record = db.session.get(File, file_id)
+    if file_record is None or not is_image(file_record) or not os.path.exists(file_record.file_path):
+        return False
+
+    paths = render_variants(file_record.file_path)
+    if paths is None:
+        return False
+
+    file_record.thumbnail_path = paths['thumb']
+    file_record.preview_path = paths['preview']
+    db.session.commit()
+    return True
+
+
+def _run(app, file_id):
+    with app.app_context():
+        generate_previews(file_id)
+
+
+def schedule_previews(app, file_record):
+    """Ставит генерацию превью в фоновый пул, если файл - изображение"""
+    global _executor
+    if not is_image(file_record):
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=app.config['PREVIEW_WORKERS'],
+                                           thread_name_prefix='previews')
+    return _executor.submit(_run, app, file_record.id)
+
+
+def remove_previews(file_path):
+    for path in variant_paths(file_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        pending = File.query.filter(File.thumbnail_path.is_(None)).all()
+        created = sum(1 for file_record in pending if is_image(file_record) and generate_previews(file_record.id))
+        print(f"✅ Создано превью: {created}")
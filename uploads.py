@@ -0,0 +1,252 @@
+"""
+Потоковая запись загружаемых файлов.
+
+Большие файлы загружаются частями (в стиле протокола tus): клиент создает
+загрузку, затем отправляет куски с заголовком Upload-Offset. Кусок сначала
+принимается во временный файл, затем смещение занимается условным UPDATE,
+и только после этого кусок дописывается в итоговый файл в uploads/task_<id>/.
+Прерванную загрузку можно продолжить с сохраненного смещения, не отправляя
+заново уже принятые байты.
+Загрузки, в которые долго не приходили куски, удаляются вместе с файлом.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from datetime import datetime
+
+from sqlalchemy import delete, select, update
+from werkzeug.exceptions import ClientDisconnected, RequestEntityTooLarge
+
+from blobstore import file_digest, remove_on_commit
+from models import db, Upload
+
+BLOCK_SIZE = 64 * 1024
+
+# Хеши незавершенных загрузок: id -> (смещение, объект hashlib).
+# Хеш продолжается, только пока куски приходят в этот процесс подряд; если
+# кусок принял другой воркер, хеш всего файла один раз считается в finish_upload.
+_hashers = {}
+_hashers_lock = threading.Lock()
+
+# Блокировки загрузок в этом процессе: куски одной загрузки не пишутся одновременно
+_upload_locks = {}
+
+
+class UploadError(Exception):
+    """Ошибка загрузки с HTTP статусом для ответа клиенту"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def task_folder(upload_folder, task_id):
+    """Папка с файлами задания, создается при необходимости"""
+    folder = os.path.join(upload_folder, f'task_{task_id}')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def unique_path(upload_folder, task_id, filename):
+    """Уникальное имя файла на диске и полный путь к нему"""
+    file_extension = os.path.splitext(filename)[1]
+    unique_filename = f"{uuid.uuid4().hex}{file_extension}"
+    return unique_filename, os.path.join(task_folder(upload_folder, task_id), unique_filename)
+
+
+def save_stream(stream, file_path):
+    """Пишет поток в файл блоками, возвращает (размер, sha256)"""
+    hasher = hashlib.sha256()
+    size = 0
+    with open(file_path, 'wb') as f:
+        while True:
+            block = stream.read(BLOCK_SIZE)
+            if not block:
+                break
+            f.write(block)
+            hasher.update(block)
+            size += len(block)
+    return size, hasher.hexdigest()
+
+
+def start_upload(upload_folder, task_id, user_id, filename, length, mime_type):
+    """Создает запись о загрузке и пустой файл на итоговом месте"""
+    unique_filename, file_path = unique_path(upload_folder, task_id, filename)
+    open(file_path, 'wb').close()
+
+    upload = Upload(
+        id=uuid.uuid4().hex,
+        filename=unique_filename,
+        original_filename=filename,
+        file_path=file_path,
+        length=length,
+        offset=0,
+        mime_type=mime_type,
+        task_id=task_id,
+        user_id=user_id
+    )
+    db.session.add(upload)
+    db.session.commit()
+    return upload
+
+
+def _upload_lock(upload_id):
+    with _hashers_lock:
+        return _upload_locks.setdefault(upload_id, threading.Lock())
+
+
+def _forget(upload_id):
+    """Убирает хеш и блокировку завершенной или удаленной загрузки"""
+    with _hashers_lock:
+        _hashers.pop(upload_id, None)
+        _upload_locks.pop(upload_id, None)
+
+
+def _cached_hasher(upload_id, offset):
+    """Хеш первых offset байт, если его вел этот процесс, иначе None"""
+    if offset == 0:
+        return hashlib.sha256()
+    with _hashers_lock:
+        cached = _hashers.pop(upload_id, None)
+    if cached and cached[0] == offset:
+        return cached[1]
+    return None
+
+
+def _keep_hasher(upload_id, offset, hasher):
+    if hasher is not None:
+        with _hashers_lock:
+            _hashers[upload_id] = (offset, hasher)
+
+
+def write_chunk(upload, stream, offset):
+    """
+    Дописывает кусок из потока запроса начиная с offset.
+
+    Принятые байты сохраняются, даже если клиент оборвал соединение
+    посреди куска, - следующий запрос продолжит с нового смещения.
+    При любой другой ошибке кусок отбрасывается, смещение не меняется.
+    """
+    lock = _upload_lock(upload.id)
+    if not lock.acquire(blocking=False):
+        raise UploadError('Предыдущий кусок этой загрузки еще принимается', 409)
+    try:
+        return _write_chunk(upload, stream, offset)
+    finally:
+        lock.release()
+
+
+def _write_chunk(upload, stream, offset):
+    # Пока запрос ждал, кусок мог принять другой поток
+    db.session.refresh(upload)
+    if offset != upload.offset:
+        raise UploadError('Смещение не совпадает с принятым объемом', 409)
+
+    hasher = _cached_hasher(upload.id, offset)
+    with tempfile.TemporaryFile(dir=os.path.dirname(upload.file_path)) as spool:
+        # Прием от клиента может быть долгим, поэтому идет без блокировок базы
+        written = _spool_chunk(stream, spool, upload.length - offset, hasher)
+        if written == 0:
+            db.session.rollback()
+            _keep_hasher(upload.id, offset, hasher)
+            return offset
+
+        # Смещение занимается до записи в файл: пока транзакция открыта,
+        # такой же UPDATE из другого воркера ждет и затем не находит строку
+        result = db.session.execute(
+            update(Upload)
+            .where(Upload.id == upload.id, Upload.offset == offset)
+            .values(offset=offset + written, updated_at=datetime.utcnow())
+        )
+        if result.rowcount != 1:
+            db.session.rollback()
+            raise UploadError('Смещение не совпадает с принятым объемом', 409)
+
+        try:
+            spool.seek(0)
+            with open(upload.file_path, 'r+b') as f:
+                f.seek(offset)
+                shutil.copyfileobj(spool, f, BLOCK_SIZE)
+                f.truncate(offset + written)
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            with open(upload.file_path, 'r+b') as f:
+                f.truncate(offset)
+            raise
+
+    _keep_hasher(upload.id, offset + written, hasher)
+    return offset + written
+
+
+def _spool_chunk(stream, spool, remaining, hasher):
+    """Принимает кусок во временный файл, возвращает число байт"""
+    written = 0
+    try:
+        while True:
+            try:
+                block = stream.read(BLOCK_SIZE)
+            except ClientDisconnected:
+                break
+            if not block:
+                break
+            if written + len(block) > remaining:
+                raise UploadError('Данных больше, чем заявленный размер файла', 413)
+            spool.write(block)
+            if hasher is not None:
+                hasher.update(block)
+            written += len(block)
+    except RequestEntityTooLarge as e:
+        # Кусок без Content-Length оказался больше MAX_CONTENT_LENGTH
+        raise UploadError('Кусок больше максимального размера запроса', 413) from e
+    return written
+
+
+def finish_upload(upload):
+    """Завершает загрузку, возвращает sha256 файла"""
+    hasher = _cached_hasher(upload.id, upload.length)
+    # Куски принимали разные воркеры - файл читается один раз целиком
+    checksum = hasher.hexdigest() if hasher is not None else file_digest(upload.file_path)
+    _forget(upload.id)
+    db.session.delete(upload)
+    return checksum
+
+
+def abort_upload(upload):
+    """Отменяет загрузку, частично записанный файл удаляется после коммита"""
+    _forget(upload.id)
+    remove_on_commit(upload.file_path)
+    db.session.delete(upload)
+
+
+def expire_uploads(max_age, now=None):
+    """
+    Удаляет загрузки, в которые не приходили куски дольше max_age
+    (timedelta), вместе с частично записанными файлами. Возвращает
+    число удаленных загрузок.
+    """
+    cutoff = (now or datetime.utcnow()) - max_age
+    expired = db.session.execute(
+        select(Upload.id, Upload.file_path).where(Upload.updated_at < cutoff)
+    ).all()
+
+    removed = []
+    for upload_id, file_path in expired:
+        # Условие повторяется: кусок мог прийти, а другой воркер - уже удалить загрузку
+        result = db.session.execute(
+            delete(Upload).where(Upload.id == upload_id, Upload.updated_at < cutoff)
+        )
+        if result.rowcount:
+            removed.append((upload_id, file_path))
+    db.session.commit()
+
+    # Файлы удаляются только после коммита
+    for upload_id, file_path in removed:
+        _forget(upload_id)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    return len(removed)
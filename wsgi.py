@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+
+"""
+Точка входа WSGI для продакшен-сервера:
+  gunicorn -c gunicorn.conf.py wsgi:app
+
+Таблицы и миграции здесь не создаются - перед запуском выполните
+python init_db.py (в Procfile и Dockerfile это уже сделано).
+"""
+
+from app import app
+
+application = app